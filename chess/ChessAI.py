@@ -1,106 +1,1090 @@
 """
 Handling the AI moves.
 """
+import contextlib
+import cProfile
+import multiprocessing
+import os
 import random
+import time
 
-piece_score = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
-
-knight_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
-                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
-                 [0.2, 0.5, 0.6, 0.65, 0.65, 0.6, 0.5, 0.2],
-                 [0.2, 0.55, 0.65, 0.7, 0.7, 0.65, 0.55, 0.2],
-                 [0.2, 0.5, 0.65, 0.7, 0.7, 0.65, 0.5, 0.2],
-                 [0.2, 0.55, 0.6, 0.65, 0.65, 0.6, 0.55, 0.2],
-                 [0.1, 0.3, 0.5, 0.55, 0.55, 0.5, 0.3, 0.1],
-                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
-
-bishop_scores = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
-                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
-                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
-                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
-                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
-                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
-                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
-
-rook_scores = [[0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
-               [0.5, 0.75, 0.75, 0.75, 0.75, 0.75, 0.75, 0.5],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.25, 0.25, 0.25, 0.5, 0.5, 0.25, 0.25, 0.25]]
-
-queen_scores = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
-                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
-
-pawn_scores = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
-               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
-               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
-               [0.25, 0.25, 0.3, 0.45, 0.45, 0.3, 0.25, 0.25],
-               [0.2, 0.2, 0.2, 0.4, 0.4, 0.2, 0.2, 0.2],
-               [0.25, 0.15, 0.1, 0.2, 0.2, 0.1, 0.15, 0.25],
-               [0.25, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.25],
-               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
-
-piece_position_scores = {"wN": knight_scores,
-                         "bN": knight_scores[::-1],
-                         "wB": bishop_scores,
-                         "bB": bishop_scores[::-1],
-                         "wQ": queen_scores,
-                         "bQ": queen_scores[::-1],
-                         "wR": rook_scores,
-                         "bR": rook_scores[::-1],
-                         "wp": pawn_scores,
-                         "bp": pawn_scores[::-1]}
+import ChessBitbase
+import ChessBook
+import ChessEvaluation
 
 CHECKMATE = 1000
 STALEMATE = 0
 DEPTH = 3
+TT_SIZE = 1 << 20  # number of transposition table slots, must be a power of two
+DEBUG_EVALUATION = False  # if True, scoreBoard checks the incremental score against a full recompute
+MOVE_ORDERING = True  # set to False to search the moves in generation order, e.g. to compare node counts
+QUIESCENCE = True  # set to False to score the horizon nodes directly instead of resolving their captures
+DELTA_MARGIN = 2  # a capture that can't lift the stand-pat score to alpha even with this much extra is pruned
+PRINCIPAL_VARIATION_SEARCH = True  # search the moves after the first with a zero window, re-search if they beat it
+# width of a zero window, less than the smallest difference between two scores: the evaluation terms are multiples
+# of 0.05 and taperedScore divides the piece-square totals by MAX_PHASE, so scores differ by 0.05 / 24 at least
+NULL_WINDOW = 0.001
+ASPIRATION_WINDOW = 1.0  # the root window around the previous depth's score, set to None to always search all
+NULL_MOVE_PRUNING = True  # pass the turn, if a reduced search still fails high the node is cut off
+NULL_MOVE_REDUCTION = 2
+LATE_MOVE_REDUCTIONS = True  # search quiet moves ordered late one ply shallower, re-search if they beat alpha
+LMR_FULL_DEPTH_MOVES = 3  # moves searched at full depth before the reductions start
+LMR_MIN_DEPTH = 3
+FUTILITY_PRUNING = True  # skip quiet moves near the leaves when even a margin can't lift the score to alpha
+FUTILITY_MARGINS = (0, 2, 5)  # by remaining depth, pruning is done where depth < len(FUTILITY_MARGINS)
+PAWN_STRUCTURE = True  # score doubled, isolated, backward and passed pawns, cached in the pawn hash table
+PAWN_HASH_SIZE = 1 << 14  # number of pawn hash table slots, must be a power of two
+DOUBLED_PAWN_PENALTY = 0.2  # for every pawn on a file after the first
+ISOLATED_PAWN_PENALTY = 0.15
+BACKWARD_PAWN_PENALTY = 0.1
+PASSED_PAWN_BONUS = (0, 0.05, 0.1, 0.2, 0.35, 0.6)  # by the ranks the pawn has advanced
+SEARCH_TIMING = False  # time move generation, make/undo and evaluation in every search, at a cost in speed
+MAX_PLY = 64
+SEARCH_WORKERS = 4  # processes used by findBestMoveParallel
+OPENING_BOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")  # None to always search
+BOOK_SEED = None  # set to a number to pick the same book moves in every game
+# generated by ChessBitbase.py, None to search KQK, KRK and KPK like any other position
+ENDGAME_BITBASES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bitbases.bin")
+BITBASE_WIN = 100  # score of a won bitbase position, less than CHECKMATE so that the search still finds the mate
 
+# move ordering bands, the hash move first, then captures, killer moves and finally quiet moves by history
+HASH_MOVE_SCORE = 1 << 50
+CAPTURE_SCORE = 1 << 40
+KILLER_SCORES = (1 << 39, 1 << 38)
 
-def findBestMove(game_state, valid_moves, return_queue):
-    global next_move
+# bound type of a transposition table score
+EXACT = 0
+LOWER_BOUND = 1  # the search failed high, the real score is at least this
+UPPER_BOUND = 2  # the search failed low, the real score is at most this
+
+
+class TranspositionTable:
+    """
+    Fixed-size hash table of already searched positions, indexed by the low bits of the Zobrist key.
+    Each slot keeps one entry: (key, depth, score, bound, best_move, generation).
+    Replacement policy: a slot is overwritten when it is empty, holds the same position, was written by an
+    earlier search (older generation) or was searched to a depth not greater than the new entry.
+    """
+
+    def __init__(self, size=TT_SIZE):
+        self.mask = size - 1
+        self.entries = [None] * size
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def newSearch(self):
+        """
+        Age the stored entries and reset the counters, called once per findBestMove.
+        """
+        self.generation += 1
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def clear(self):
+        self.entries = [None] * (self.mask + 1)
+
+    def probe(self, key):
+        self.probes += 1
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, best_move):
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is None or entry[0] == key or entry[5] != self.generation or depth >= entry[1]:
+            if best_move is None and entry is not None and entry[0] == key:
+                best_move = entry[4]  # keep the move of a shallower search of the same position
+            self.entries[index] = (key, depth, score, bound, best_move, self.generation)
+            self.stores += 1
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def bestMove(self, key):
+        """
+        The best move stored for the position with the key, or None. Not counted as a probe.
+        """
+        entry = self.entries[key & self.mask]
+        return entry[4] if entry is not None and entry[0] == key else None
+
+
+class PawnHashTable:
+    """
+    Fixed-size cache of pawn-structure scores, indexed by the low bits of GameState.pawn_key. The pawns change
+    in few of the moves searched, so most positions find the score of their pawns here. A slot is always
+    overwritten, and the table is kept from one search to the next.
+    """
+
+    def __init__(self, size=PAWN_HASH_SIZE):
+        self.mask = size - 1
+        self.keys = [None] * size
+        self.scores = [0] * size
+        self.probes = 0
+        self.hits = 0
+
+    def clear(self):
+        self.keys = [None] * (self.mask + 1)
+
+    def probe(self, key):
+        """
+        The stored score of the pawns with the key, None if they aren't in the table.
+        """
+        self.probes += 1
+        index = key & self.mask
+        if self.keys[index] == key:
+            self.hits += 1
+            return self.scores[index]
+        return None
+
+    def store(self, key, score):
+        index = key & self.mask
+        self.keys[index] = key
+        self.scores[index] = score
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+
+class SearchStats:
+    """
+    Counters of a single findBestMove call, returned by it next to the move.
+    """
+
+    def __init__(self):
+        self.nodes = 0
+        self.quiescence_nodes = 0  # positions searched by quiescenceSearch, including the horizon nodes
+        self.interior_nodes = 0  # nodes whose moves were searched
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.null_move_cutoffs = 0
+        self.reductions = 0
+        self.reduction_re_searches = 0  # reduced moves that beat alpha and were searched again at full depth
+        self.futility_prunes = 0
+        self.pvs_re_searches = 0  # zero-window searches that beat alpha and were searched again with the window
+        self.aspiration_fail_highs = 0
+        self.aspiration_fail_lows = 0
+        self.evaluations = 0  # scoreBoard calls
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.pawn_hash_probes = 0
+        self.pawn_hash_hits = 0
+        self.nodes_by_depth = {}  # completed depth -> nodes searched until it was finished
+        self.seconds_by_depth = {}  # completed depth -> seconds from the start of the search until it was finished
+        self.phase_seconds = {}  # with SEARCH_TIMING, PHASES name -> seconds spent in it
+        self.depth = 0  # last completed depth
+        self.score = 0  # score of the last completed depth, from the point of view of the side to move
+        self.principal_variation = []
+        self.book_move = False  # True if the move came from the opening book and nothing was searched
+        self.bitbase_hits = 0
+
+    def add(self, other):
+        """
+        Add the counters of a search done elsewhere, e.g. by a findBestMoveParallel worker.
+        """
+        self.nodes += other.nodes
+        self.quiescence_nodes += other.quiescence_nodes
+        self.interior_nodes += other.interior_nodes
+        self.cutoffs += other.cutoffs
+        self.first_move_cutoffs += other.first_move_cutoffs
+        self.null_move_cutoffs += other.null_move_cutoffs
+        self.reductions += other.reductions
+        self.reduction_re_searches += other.reduction_re_searches
+        self.futility_prunes += other.futility_prunes
+        self.pvs_re_searches += other.pvs_re_searches
+        self.aspiration_fail_highs += other.aspiration_fail_highs
+        self.aspiration_fail_lows += other.aspiration_fail_lows
+        self.bitbase_hits += other.bitbase_hits
+        self.evaluations += other.evaluations
+        self.tt_probes += other.tt_probes
+        self.tt_hits += other.tt_hits
+        self.pawn_hash_probes += other.pawn_hash_probes
+        self.pawn_hash_hits += other.pawn_hash_hits
+        for phase, seconds in other.phase_seconds.items():
+            self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+
+    def cutoffRate(self):
+        return self.cutoffs / self.interior_nodes if self.interior_nodes else 0.0
+
+    def firstMoveCutoffRate(self):
+        """
+        Share of the cutoffs produced by the first move searched, 1.0 means perfect ordering.
+        """
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def ttHitRate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    def pawnHashHitRate(self):
+        return self.pawn_hash_hits / self.pawn_hash_probes if self.pawn_hash_probes else 0.0
+
+    def branchingFactors(self):
+        """
+        {depth: nodes of the depth / nodes of the depth before}, the effective branching factor of every depth.
+        """
+        depths = sorted(self.nodes_by_depth)
+        factors = {}
+        for previous, depth in zip(depths, depths[1:]):
+            previous_nodes = self.nodes_by_depth[previous] - self.nodes_by_depth.get(previous - 1, 0)
+            if previous_nodes:
+                factors[depth] = (self.nodes_by_depth[depth] - self.nodes_by_depth[previous]) / previous_nodes
+        return factors
+
+    def summary(self):
+        """
+        The counters as text, a few lines to print or log after a search.
+        """
+        lines = ["depth %d, score %.2f, %d nodes + %d quiescence nodes, %d evaluations" % (
+                     self.depth, self.score, self.nodes, self.quiescence_nodes, self.evaluations),
+                 "cutoffs %d (%.1f%% of interior nodes, %.1f%% by the first move), TT hits %.1f%% of %d probes" % (
+                     self.cutoffs, 100 * self.cutoffRate(), 100 * self.firstMoveCutoffRate(), 100 * self.ttHitRate(),
+                     self.tt_probes)]
+        if self.pawn_hash_probes:
+            lines.append("pawn hash hits %.1f%% of %d probes" % (100 * self.pawnHashHitRate(), self.pawn_hash_probes))
+        factors = self.branchingFactors()
+        for depth in sorted(self.nodes_by_depth):
+            lines.append("  depth %2d: %8d nodes %8.3fs%s" % (
+                depth, self.nodes_by_depth[depth], self.seconds_by_depth.get(depth, 0.0),
+                "  branching %.1f" % factors[depth] if depth in factors else ""))
+        total = sum(self.phase_seconds.values())
+        if total:
+            lines.append("time: " + ", ".join("%s %.1f%%" % (phase, 100 * self.phase_seconds.get(phase, 0.0) / total)
+                                              for phase in PHASES))
+        return "\n".join(lines)
+
+
+PHASES = ("move generation", "make/undo", "evaluation", "search")
+TIMED_METHODS = {"getValidMoves": "move generation", "generateMoves": "move generation", "inCheck": "move generation",
+                 "makeMove": "make/undo", "undoMove": "make/undo", "makeNullMove": "make/undo",
+                 "undoNullMove": "make/undo"}
+
+
+class PhaseTimer:
+    """
+    Splits the time of a search between the PHASES while it is installed, by wrapping the TIMED_METHODS of the
+    game state and scoreBoard. The time of a call made from another timed call (e.g. the legality check of the
+    move generator making the move) counts for the inner one only, so the phases add up to the whole search.
+    """
+
+    def __init__(self, game_state):
+        self.game_state = game_state
+        self.seconds = {phase: 0.0 for phase in PHASES}
+        self.phase = "search"
+        self.start = time.perf_counter()
+
+    def enter(self, phase):
+        now = time.perf_counter()
+        self.seconds[self.phase] += now - self.start
+        outer_phase, self.phase, self.start = self.phase, phase, now
+        return outer_phase
+
+    def leave(self, outer_phase):
+        now = time.perf_counter()
+        self.seconds[self.phase] += now - self.start
+        self.phase, self.start = outer_phase, now
+
+    def timed(self, function, phase):
+        def timedFunction(*args, **kwargs):
+            outer_phase = self.enter(phase)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.leave(outer_phase)
+        return timedFunction
+
+    def timedGenerator(self, function, phase):
+        def timedGeneratorFunction(*args, **kwargs):
+            moves = function(*args, **kwargs)
+            while True:
+                outer_phase = self.enter(phase)
+                try:
+                    move = next(moves, None)
+                finally:
+                    self.leave(outer_phase)
+                if move is None:
+                    return
+                yield move
+        return timedGeneratorFunction
+
+    def install(self):
+        global scoreBoard
+        for name, phase in TIMED_METHODS.items():
+            method = getattr(self.game_state, name)
+            wrap = self.timedGenerator if name == "generateMoves" else self.timed
+            setattr(self.game_state, name, wrap(method, phase))  # an instance attribute hides the method
+        self.score_board = scoreBoard
+        scoreBoard = self.timed(scoreBoard, "evaluation")
+
+    def remove(self):
+        """
+        Take the wrappers away and return the seconds of every phase.
+        """
+        global scoreBoard
+        for name in TIMED_METHODS:
+            delattr(self.game_state, name)
+        scoreBoard = self.score_board
+        self.enter("search")
+        return self.seconds
+
+
+class SearchPool:
+    """
+    The worker processes of findBestMoveParallel, kept from one search to the next, e.g. for a whole game, so that
+    they start only once and their transposition tables, killer moves and history stay warm. Each worker sets up
+    game_state once and is then sent only the moveIDs of the moves played, like ChessWorker's engine process.
+    A search is stopped through the pool's own event, set while the caller's stop_event is.
+    Close it when done, or use it as a context manager.
+    """
+
+    def __init__(self, game_state, workers=SEARCH_WORKERS):
+        self.workers = workers
+        self.game = 0  # counts newGame calls, a worker that sees a new one starts over
+        self.root_fen = rootFen(game_state)  # position the game started from, a new game is set up from it
+        self.searches = 0
+        self.stop = multiprocessing.Event()
+        self.pool = multiprocessing.Pool(workers, initializer=initSearchWorker, initargs=(game_state, self.stop))
+
+    def newGame(self, game_state):
+        """
+        The next search is of a new game, the one of game_state. The workers clear their tables and set up the
+        position it started from.
+        """
+        self.game += 1
+        self.root_fen = rootFen(game_state)
+
+    def newSearch(self, game_state):
+        """
+        The position the workers search from until the next call: (game, FEN the game started from, search number,
+        moveIDs of game_state's moves), sent along with every root move.
+        """
+        self.searches += 1
+        self.stop.clear()
+        return self.game, self.root_fen, self.searches, [move.moveID for move in game_state.move_log]
+
+    def wait(self, result):
+        """
+        The value of an asynchronous pool call, once it is ready. The workers are stopped when stop_event is set.
+        """
+        while not result.ready():
+            result.wait(0.01)
+            if stop_event is not None and stop_event.is_set():
+                self.stop.set()
+        return result.get()
+
+    def apply(self, function, args):
+        return self.wait(self.pool.apply_async(function, args))
+
+    def starmap(self, function, tasks):
+        return self.wait(self.pool.starmap_async(function, tasks, chunksize=1))
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def rootFen(game_state):
+    """
+    FEN of game_state before the moves of its move_log, which are taken back and played again to get it.
+    """
+    moves = list(game_state.move_log)
+    for _ in moves:
+        game_state.undoMove()
+    fen = game_state.getFen()
+    for move in moves:
+        game_state.makeMove(move)
+    return fen
+
+
+transposition_table = TranspositionTable()
+pawn_table = PawnHashTable()
+search_stats = SearchStats()
+killer_moves = [[None, None] for _ in range(MAX_PLY)]  # moveIDs of two quiet moves that caused a cutoff per ply
+history_scores = {}  # moveID -> how often (weighted by depth) the quiet move caused a cutoff
+pv_table = [[] for _ in range(MAX_PLY + 1)]  # principal variation found below each ply in the current iteration
+previous_pv = []  # principal variation of the last completed iteration
+following_pv = False  # True while the search is still on the path of previous_pv
+search_aborted = False
+deadline = None  # time.perf_counter() value at which the search stops, None if there is no time limit
+node_limit = None
+stop_event = None  # the search stops once stop_event.is_set(), e.g. on a stop command sent to ChessWorker
+depth_listener = None  # called with search_stats after every completed depth, e.g. to print UCI info lines
+worker_game_state = None  # position the root moves are searched from in a findBestMoveParallel worker process
+worker_game = 0  # SearchPool.game of worker_game_state
+worker_search = 0  # SearchPool.searches of the search worker_game_state was last set up for
+opening_book = None  # ChessBook.OpeningBook of OPENING_BOOK, opened by findBookMove
+opening_book_path = None  # OPENING_BOOK as last tried by findBookMove, a missing file isn't looked for again
+book_random = random.Random()  # picks the book moves, seeded with BOOK_SEED when the book is opened and by newGame
+bitbases = None  # ChessBitbase.Bitbases of ENDGAME_BITBASES, opened by startNewSearch once they are generated
+bitbase_leaves_only = False  # True when the root is already a bitbase ending, see findMoveNegaMaxAlphaBeta
+profile_path = None  # set by profileNextSearch
+
+
+def findBestMove(game_state, valid_moves, return_queue, movetime=None, max_depth=DEPTH, max_nodes=None,
+                 use_book=True):
+    """
+    Iterative deepening: search depth 1, 2, 3, ... until max_depth is done or the movetime (milliseconds)
+    or max_nodes budget runs out. The best move of the last completed depth (or of the root moves searched so far,
+    if depth 1 doesn't finish) is put in the return_queue (if not None), unless use_book is True and the opening book
+    has a move for the position.
+    Returns (move, SearchStats of the search).
+    Each depth starts with an aspiration window of ASPIRATION_WINDOW around the previous depth's score.
+    """
+    global next_move, search_stats
     next_move = None
+    search_stats = SearchStats()
+    book_move = findBookMove(game_state, valid_moves) if use_book else None
+    if book_move is not None:
+        if return_queue is not None:
+            return_queue.put(book_move)
+        return book_move, search_stats
     random.shuffle(valid_moves)
-    findMoveNegaMaxAlphaBeta(game_state, valid_moves, DEPTH, -CHECKMATE, CHECKMATE,
-                             1 if game_state.white_to_move else -1)
-    return_queue.put(next_move)
+    startNewSearch(game_state)
+    pawn_probes, pawn_hits = pawn_table.probes, pawn_table.hits
+    with instrumentSearch(game_state):
+        iterativeDeepening(game_state, valid_moves, movetime, max_depth, max_nodes)
+    search_stats.tt_probes = transposition_table.probes
+    search_stats.tt_hits = transposition_table.hits
+    search_stats.pawn_hash_probes = pawn_table.probes - pawn_probes
+    search_stats.pawn_hash_hits = pawn_table.hits - pawn_hits
+    if return_queue is not None:
+        return_queue.put(next_move)
+    return next_move, search_stats
 
 
-def findMoveNegaMaxAlphaBeta(game_state, valid_moves, depth, alpha, beta, turn_multiplier):
+def iterativeDeepening(game_state, valid_moves, movetime, max_depth, max_nodes):
+    """
+    The depth loop of findBestMove, leaves the best move in next_move.
+    """
+    global next_move, previous_pv, following_pv, search_aborted, deadline, node_limit
+    start_time = time.perf_counter()
+    deadline = start_time + movetime / 1000 if movetime is not None else None
+    node_limit = max_nodes
+    search_aborted = False
+    previous_pv = []
+    turn_multiplier = 1 if game_state.white_to_move else -1
+    score = 0
+    for depth in range(1, min(max_depth, MAX_PLY) + 1):
+        # the full window is one wider than the worst score, so a move is picked even when all of them get mated
+        alpha, beta = -CHECKMATE - 1, CHECKMATE + 1
+        window = ASPIRATION_WINDOW
+        if window is not None and depth > 1:
+            alpha, beta = score - window, score + window
+        while True:
+            following_pv = True
+            score = findMoveNegaMaxAlphaBeta(game_state, valid_moves, depth, alpha, beta, turn_multiplier)
+            if search_aborted:
+                if next_move is None and valid_moves:  # stopped during depth 1, take the best root move so far
+                    next_move = pv_table[0][0] if pv_table[0] else valid_moves[0]
+                break
+            # outside the window the score is only a bound, widen that side and search again
+            if score <= alpha and alpha > -CHECKMATE - 1:
+                search_stats.aspiration_fail_lows += 1
+                window *= 2
+                alpha = max(score - window, -CHECKMATE - 1)
+            elif score >= beta and beta < CHECKMATE + 1:
+                search_stats.aspiration_fail_highs += 1
+                window *= 2
+                beta = min(score + window, CHECKMATE + 1)
+            else:
+                break
+        if search_aborted:
+            break
+        previous_pv = pv_table[0]
+        if previous_pv:
+            next_move = previous_pv[0]
+        search_stats.nodes_by_depth[depth] = search_stats.nodes
+        search_stats.seconds_by_depth[depth] = time.perf_counter() - start_time
+        search_stats.depth = depth
+        search_stats.score = score
+        search_stats.principal_variation = previous_pv
+        if depth_listener is not None:
+            depth_listener(search_stats)
+        if abs(score) >= CHECKMATE:
+            break  # a forced mate was found, searching deeper won't change the move
+        if deadline is not None and time.perf_counter() - start_time > (deadline - start_time) / 2:
+            break  # the next depth would most likely not finish in the remaining time
+
+
+def findBestMoveParallel(game_state, valid_moves, return_queue, movetime=None, max_depth=DEPTH, max_nodes=None,
+                         workers=SEARCH_WORKERS, use_book=True, search_pool=None):
+    """
+    Iterative deepening like findBestMove, with the root moves split across a pool of worker processes.
+    At every depth the expected best move is searched first with the full window, then the other moves are
+    searched in parallel against its score, so most of them are still cut off as in the sequential search.
+    With PRINCIPAL_VARIATION_SEARCH that is a zero window, and the moves that fail high are searched again.
+    Each worker keeps its own transposition table, killer moves and history from one depth to the next.
+    The workers are those of search_pool, or a SearchPool of workers processes started for this search only.
+    max_nodes is checked after every depth, a depth that used more nodes is thrown away.
+    The best move of the last completed depth (of the root moves searched so far if depth 1 doesn't finish, or the
+    book move with use_book) is put in the return_queue (if not None).
+    Returns (move, SearchStats of the search, with the counters of all workers).
+    A profile (profileNextSearch) only covers this process, the workers' time shows up as waiting for the pool.
+    """
+    global next_move, search_stats
+    next_move = None
+    search_stats = SearchStats()
+    book_move = findBookMove(game_state, valid_moves) if use_book else None
+    if book_move is not None:
+        if return_queue is not None:
+            return_queue.put(book_move)
+        return book_move, search_stats
+    random.shuffle(valid_moves)
+    startNewSearch(game_state)
+    orderMoves(valid_moves, None, 0)
+    with instrumentSearch(None):
+        if search_pool is not None:
+            parallelIterativeDeepening(game_state, valid_moves, movetime, max_depth, max_nodes, search_pool)
+        else:
+            with SearchPool(game_state, workers) as search_pool:
+                parallelIterativeDeepening(game_state, valid_moves, movetime, max_depth, max_nodes, search_pool)
+    if return_queue is not None:
+        return_queue.put(next_move)
+    return next_move, search_stats
+
+
+def parallelIterativeDeepening(game_state, valid_moves, movetime, max_depth, max_nodes, search_pool):
+    """
+    The depth loop of findBestMoveParallel, leaves the best move in next_move.
+    """
     global next_move
+    position = search_pool.newSearch(game_state)
+    root_moves = list(valid_moves)
+    principal_variation = []
+    start_time = time.perf_counter()
+    # perf_counter is a system-wide clock, so the workers can compare it with the same deadline
+    search_deadline = start_time + movetime / 1000 if movetime is not None else None
+    for depth in range(1, min(max_depth, MAX_PLY) + 1):
+        if not root_moves:
+            break
+        search_stats.nodes += 1  # the root itself
+        remaining_nodes = max_nodes - search_stats.nodes if max_nodes is not None else None
+        move, score, pv, stats, aborted = search_pool.apply(searchRootMove, (
+            position, root_moves[0], depth, -CHECKMATE - 1, CHECKMATE + 1, principal_variation, search_deadline,
+            remaining_nodes))
+        search_stats.add(stats)
+        best_move, best_score, best_pv = move, score, pv
+        root_scores = {move.moveID: score}
+        beta = best_score + NULL_WINDOW if PRINCIPAL_VARIATION_SEARCH else CHECKMATE + 1
+        tasks = [] if aborted else [(position, move, depth, best_score, beta, [], search_deadline, remaining_nodes)
+                                    for move in root_moves[1:]]
+        fail_highs = []
+        for move, score, pv, stats, move_aborted in search_pool.starmap(searchRootMove, tasks):
+            search_stats.add(stats)
+            if move_aborted:  # the score is meaningless
+                aborted = True
+                continue
+            root_scores[move.moveID] = score
+            if score >= beta:
+                fail_highs.append(move)
+            elif score > best_score:
+                best_move, best_score, best_pv = move, score, pv
+        for move in fail_highs:  # beat the first move's score, find out by how much
+            if aborted:
+                break
+            search_stats.pvs_re_searches += 1
+            move, score, pv, stats, aborted = search_pool.apply(searchRootMove, (
+                position, move, depth, best_score, CHECKMATE + 1, [], search_deadline, remaining_nodes))
+            search_stats.add(stats)
+            if aborted:
+                break
+            root_scores[move.moveID] = score
+            if score > best_score:
+                best_move, best_score, best_pv = move, score, pv
+        if aborted or (max_nodes is not None and search_stats.nodes > max_nodes):
+            if next_move is None:  # stopped during depth 1, take the best root move searched so far
+                next_move = best_move
+            break
+        next_move = best_move
+        principal_variation = best_pv
+        # search the best move first at the next depth, then the others by their score at this one
+        root_moves.sort(key=lambda root_move: (root_move.moveID != best_move.moveID,
+                                               -root_scores[root_move.moveID]))
+        search_stats.nodes_by_depth[depth] = search_stats.nodes
+        search_stats.seconds_by_depth[depth] = time.perf_counter() - start_time
+        search_stats.depth = depth
+        search_stats.score = best_score
+        search_stats.principal_variation = best_pv
+        if depth_listener is not None:
+            depth_listener(search_stats)
+        if abs(best_score) >= CHECKMATE:
+            break  # a forced mate was found, searching deeper won't change the move
+        if search_deadline is not None and time.perf_counter() - start_time > (search_deadline - start_time) / 2:
+            break  # the next depth would most likely not finish in the remaining time
+
+
+def initSearchWorker(game_state, stop):
+    """
+    Set up a SearchPool worker process, the position is sent once and then kept up to date with setWorkerPosition.
+    """
+    global worker_game_state, stop_event
+    worker_game_state = game_state
+    stop_event = stop
+
+
+def setWorkerPosition(position):
+    """
+    Bring worker_game_state to the position of SearchPool.newSearch: take back the moves that weren't played and
+    play the new ones. The first root move of every search also starts the search in this worker.
+    """
+    global worker_game_state, worker_game, worker_search
+    game, root_fen, search, move_ids = position
+    if search == worker_search:
+        return
+    if game != worker_game:
+        underpromotions = worker_game_state.underpromotions
+        worker_game_state = type(worker_game_state)(root_fen)
+        worker_game_state.underpromotions = underpromotions
+        worker_game = game
+        newGame()
+    played = worker_game_state.move_log
+    common = 0
+    while common < min(len(played), len(move_ids)) and played[common].moveID == move_ids[common]:
+        common += 1
+    for _ in range(len(played) - common):
+        worker_game_state.undoMove()
+    for move_id in move_ids[common:]:
+        move = next((move for move in worker_game_state.getValidMoves() if move.moveID == move_id), None)
+        if move is None:
+            raise ValueError("moveID %d is not a legal move in the worker's position %s" %
+                             (move_id, worker_game_state.getFen()))
+        worker_game_state.makeMove(move)
+    worker_search = search
+    startNewSearch(worker_game_state)
+
+
+def searchRootMove(position, move, depth, alpha, beta, principal_variation, search_deadline, max_nodes):
+    """
+    Search one root move of the position (see SearchPool.newSearch) in a SearchPool worker.
+    Returns (move, score, principal variation starting with the move, SearchStats, True if aborted).
+    """
+    global search_stats, previous_pv, following_pv, search_aborted, deadline, node_limit
+    setWorkerPosition(position)
+    game_state = worker_game_state
+    search_stats = SearchStats()
+    search_stats.depth = depth - 1  # the time budget of checkLimits only counts once the first depth is done
+    deadline = search_deadline
+    node_limit = max_nodes
+    search_aborted = False
+    previous_pv = principal_variation
+    following_pv = len(principal_variation) > 0 and principal_variation[0] == move
+    checkLimits()
+    if search_aborted:  # don't start on the moves still queued when the search is stopped or out of time
+        return move, 0, [move], search_stats, True
+    turn_multiplier = 1 if game_state.white_to_move else -1
+    tt_probes, tt_hits = transposition_table.probes, transposition_table.hits
+    pawn_probes, pawn_hits = pawn_table.probes, pawn_table.hits
+    with instrumentSearch(game_state, profile=False):
+        game_state.makeMove(move)
+        score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -beta, -alpha, -turn_multiplier, 1)
+        game_state.undoMove()
+    search_stats.tt_probes = transposition_table.probes - tt_probes
+    search_stats.tt_hits = transposition_table.hits - tt_hits
+    search_stats.pawn_hash_probes = pawn_table.probes - pawn_probes
+    search_stats.pawn_hash_hits = pawn_table.hits - pawn_hits
+    return move, score, [move] + pv_table[1], search_stats, search_aborted
+
+
+def profileNextSearch(path):
+    """
+    Profile the next findBestMove or findBestMoveParallel call with cProfile and write the profile to path,
+    to be read with pstats or snakeviz, e.g. python -m pstats path.
+    """
+    global profile_path
+    profile_path = path
+
+
+@contextlib.contextmanager
+def instrumentSearch(game_state, profile=True):
+    """
+    Around a search: time its phases with a PhaseTimer on game_state if SEARCH_TIMING is on (and game_state given),
+    and profile it if profileNextSearch asked for it (and profile is True).
+    """
+    global profile_path
+    timer = PhaseTimer(game_state) if SEARCH_TIMING and game_state is not None else None
+    profiler = None
+    if profile and profile_path is not None:
+        profiler, path, profile_path = cProfile.Profile(), profile_path, None
+        profiler.enable()
+    if timer is not None:
+        timer.install()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            for phase, seconds in timer.remove().items():
+                search_stats.phase_seconds[phase] = search_stats.phase_seconds.get(phase, 0.0) + seconds
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(path)
+
+
+def extendPrincipalVariation(game_state, principal_variation, length):
+    """
+    The principal variation from game_state continued with the best moves of the transposition table, up to length
+    moves. A transposition table cutoff ends the variation of the search early, but the table usually still has
+    the moves that follow. Every move is checked to be legal. game_state is left as it was.
+    """
+    variation = []
+    for move in principal_variation[:length]:
+        if move not in game_state.getValidMoves():
+            break
+        game_state.makeMove(move)
+        variation.append(move)
+    while len(variation) < length:
+        move = transposition_table.bestMove(game_state.zobrist_key)
+        if move is None or move not in game_state.getValidMoves():
+            break
+        game_state.makeMove(move)
+        variation.append(move)
+    for _ in variation:
+        game_state.undoMove()
+    return variation
+
+
+def findBookMove(game_state, valid_moves):
+    """
+    A move from the opening book for the position, or None if it isn't in the book or there is no book.
+    """
+    global opening_book, opening_book_path
+    if OPENING_BOOK is None:
+        return None
+    if OPENING_BOOK != opening_book_path:
+        if opening_book is not None:
+            opening_book.close()
+        opening_book = ChessBook.openBook(OPENING_BOOK)
+        opening_book_path = OPENING_BOOK
+        book_random.seed(BOOK_SEED)
+    if opening_book is None:
+        return None
+    move = opening_book.findMove(game_state, valid_moves, book_random)
+    if move is not None:
+        search_stats.book_move = True
+        search_stats.principal_variation = [move]
+    return move
+
+
+def newGame():
+    """
+    Forget the previous game: clear the transposition table and the history, and start picking the book moves
+    from BOOK_SEED again.
+    """
+    transposition_table.clear()
+    history_scores.clear()
+    book_random.seed(BOOK_SEED)
+
+
+def startNewSearch(game_state):
+    """
+    Age the transposition table and the move ordering tables before a new search from game_state.
+    """
+    global bitbases, bitbase_leaves_only
+    if bitbases is None and ENDGAME_BITBASES is not None:
+        bitbases = ChessBitbase.openBitbases(ENDGAME_BITBASES)
+    bitbase_leaves_only = game_state.piece_count <= 3
+    transposition_table.newSearch()
+    for killers in killer_moves:
+        killers[0] = killers[1] = None
+    for move_id in history_scores:
+        history_scores[move_id] //= 2  # keep older history but let this search dominate
+
+
+def checkLimits():
+    """
+    Abort the search once the time or node budget is used up or it was asked to stop.
+    The time budget only counts once depth 1 is done, so that there is a move to play however short it is.
+    Stopped or out of nodes during depth 1, the search falls back to the best root move searched so far.
+    """
+    global search_aborted
+    nodes = search_stats.nodes + search_stats.quiescence_nodes
+    if node_limit is not None and nodes >= node_limit:
+        search_aborted = True
+    elif nodes & 255 == 0 and ((deadline is not None and search_stats.depth > 0 and time.perf_counter() >= deadline) or
+                               (stop_event is not None and stop_event.is_set())):
+        search_aborted = True
+
+
+def orderMoves(valid_moves, hash_move, ply):
+    """
+    Sort the moves so that the ones most likely to cause a cutoff come first: the hash move, captures by
+    most valuable victim / least valuable attacker, the killer moves of this ply and then the quiet moves
+    by their history score.
+    """
+    hash_move_id = hash_move.moveID if hash_move is not None else -1
+    first_killer, second_killer = killer_moves[ply]
+    mvv_lva_value = ChessEvaluation.mvv_lva_value
+
+    def moveScore(move):
+        move_id = move.moveID
+        if move_id == hash_move_id:
+            return HASH_MOVE_SCORE
+        if move.is_capture:
+            return CAPTURE_SCORE + 16 * mvv_lva_value[move.piece_captured[1]] - mvv_lva_value[move.piece_moved[1]]
+        if move.is_pawn_promotion:
+            return CAPTURE_SCORE + 16 * mvv_lva_value[move.promotion_piece]
+        if move_id == first_killer:
+            return KILLER_SCORES[0]
+        if move_id == second_killer:
+            return KILLER_SCORES[1]
+        return history_scores.get(move_id, 0)
+
+    valid_moves.sort(key=moveScore, reverse=True)
+
+
+def quietMoveKey(ply):
+    """
+    Ordering key of the quiet moves at this ply for GameState.generateMoves: killer moves first, then history.
+    """
+    first_killer, second_killer = killer_moves[ply]
+
+    def moveKey(move_id):
+        if move_id == first_killer:
+            return KILLER_SCORES[0]
+        if move_id == second_killer:
+            return KILLER_SCORES[1]
+        return history_scores.get(move_id, 0)
+
+    return moveKey
+
+
+def storeCutoff(move, depth, ply):
+    """
+    Remember a quiet move that caused a beta cutoff as a killer move and in the history table.
+    """
+    if move.is_capture or move.is_pawn_promotion:
+        return
+    killers = killer_moves[ply]
+    if killers[0] != move.moveID:
+        killers[1] = killers[0]
+        killers[0] = move.moveID
+    history_scores[move.moveID] = history_scores.get(move.moveID, 0) + depth * depth
+
+
+def findMoveNegaMaxAlphaBeta(game_state, valid_moves, depth, alpha, beta, turn_multiplier, ply=0, allow_null=True):
+    """
+    Negamax with alpha-beta pruning. valid_moves is only given at the root, below it the moves are generated
+    lazily in stages (hash move, captures, quiet moves) and only if the transposition table can't answer for
+    this position, so a cutoff saves creating the moves that would have come after it.
+    Away from the root and the principal variation the tree is cut further, each switchable on its own:
+    null-move pruning (allow_null is False right after a null move), late move reductions for quiet moves
+    and futility pruning of quiet moves near the leaves. Checks and check evasions are never cut.
+    """
+    global following_pv, search_aborted
+    search_stats.nodes += 1
+    checkLimits()
+    pv_table[ply] = []
+    alpha_original = alpha
+    entry = transposition_table.probe(game_state.zobrist_key)
+    if entry is not None and entry[1] >= depth and ply != 0:  # the root has to pick a move itself
+        score, bound = entry[2], entry[3]
+        if bound == EXACT:
+            return score
+        if bound == LOWER_BOUND and score > alpha:
+            alpha = score
+        elif bound == UPPER_BOUND and score < beta:
+            beta = score
+        if alpha >= beta:
+            return score
+    # A bitbase ending reached by the search is scored at once. When the game is already in one, win or draw
+    # alone doesn't say how to make progress, so the tree is searched for the mate and only its leaves probed.
+    if bitbases is not None and game_state.piece_count == 3 and ply != 0 and (depth == 0 or not bitbase_leaves_only):
+        score = bitbaseScore(game_state)
+        if score is not None:
+            search_stats.bitbase_hits += 1
+            return turn_multiplier * score
     if depth == 0:
-        return turn_multiplier * scoreBoard(game_state)
-    # move ordering - implement later //TODO
-    max_score = -CHECKMATE
-    for move in valid_moves:
+        if QUIESCENCE:
+            return quiescenceSearch(game_state, alpha, beta, turn_multiplier)
+        if valid_moves is None:
+            # checkmate and stalemate are told apart from the rest by whether there is any move at all
+            next(game_state.generateMoves(), None)
+        score = turn_multiplier * scoreBoard(game_state)
+        transposition_table.store(game_state.zobrist_key, depth, score, EXACT, None)
+        return score
+    hash_move = entry[4] if entry is not None else None
+    if following_pv:  # the previous iteration's principal variation is searched first
+        if ply < len(previous_pv):
+            hash_move = previous_pv[ply]
+        else:
+            following_pv = False
+    in_check = game_state.inCheck()
+    if NULL_MOVE_PRUNING and allow_null and ply > 0 and not in_check and not following_pv and depth >= 2 and \
+            beta < CHECKMATE and game_state.hasPieces("w" if game_state.white_to_move else "b"):
+        # no null move in check (illegal), twice in a row or with only pawns left, where zugzwang is common
+        game_state.makeNullMove()
+        score = -findMoveNegaMaxAlphaBeta(game_state, None, max(0, depth - 1 - NULL_MOVE_REDUCTION), -beta,
+                                          -beta + NULL_WINDOW, -turn_multiplier, ply + 1, False)
+        game_state.undoNullMove()
+        if search_aborted:
+            return 0
+        if score >= beta:
+            search_stats.null_move_cutoffs += 1
+            transposition_table.store(game_state.zobrist_key, depth, beta, LOWER_BOUND, None)
+            return beta  # a mate found after passing isn't a real one
+    futile = False
+    if FUTILITY_PRUNING and depth < len(FUTILITY_MARGINS) and ply > 0 and not in_check and not following_pv and \
+            -BITBASE_WIN < alpha < BITBASE_WIN:  # not with mate or known win scores
+        futility_score = turn_multiplier * scoreBoard(game_state) + FUTILITY_MARGINS[depth]
+        futile = futility_score <= alpha
+    reduce = LATE_MOVE_REDUCTIONS and depth >= LMR_MIN_DEPTH and ply > 0 and not in_check
+    if valid_moves is not None:
+        if MOVE_ORDERING:
+            orderMoves(valid_moves, hash_move, ply)
+        moves = valid_moves
+    elif MOVE_ORDERING:
+        moves = game_state.generateMoves(hash_move, quietMoveKey(ply))
+    else:
+        moves = game_state.getValidMoves()
+    max_score = -CHECKMATE - 1
+    best_move = None
+    pruned = False
+    for move_number, move in enumerate(moves):
+        following_pv = following_pv and move_number == 0 and move == hash_move
         game_state.makeMove(move)
-        next_moves = game_state.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(game_state, next_moves, depth - 1, -beta, -alpha, -turn_multiplier)
+        prunable = not move.is_capture and not move.is_pawn_promotion and \
+            (futile or reduce and move_number >= LMR_FULL_DEPTH_MOVES) and not game_state.inCheck()
+        if prunable and futile:
+            game_state.undoMove()
+            search_stats.futility_prunes += 1
+            pruned = True
+            if futility_score > max_score:
+                max_score = futility_score
+            continue
+        if best_move is None:  # the first move searched gets the full window
+            score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -beta, -alpha, -turn_multiplier, ply + 1)
+        else:
+            reduced = prunable and reduce and move_number >= LMR_FULL_DEPTH_MOVES
+            if reduced:
+                search_stats.reductions += 1
+                score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 2, -alpha - NULL_WINDOW, -alpha,
+                                                  -turn_multiplier, ply + 1)
+                reduced = score <= alpha  # the reduced search is only trusted to show that a move is bad
+                if not reduced:
+                    search_stats.reduction_re_searches += 1
+            if not reduced and PRINCIPAL_VARIATION_SEARCH and not search_aborted:
+                # prove the move is no better than alpha with a zero window, search it properly only if it is
+                score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -alpha - NULL_WINDOW, -alpha,
+                                                  -turn_multiplier, ply + 1)
+                if alpha < score < beta and not search_aborted:
+                    search_stats.pvs_re_searches += 1
+                    score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -beta, -alpha,
+                                                      -turn_multiplier, ply + 1)
+            elif not reduced and not search_aborted:
+                score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -beta, -alpha, -turn_multiplier,
+                                                  ply + 1)
+        game_state.undoMove()
+        if search_aborted:
+            return 0
         if score > max_score:
             max_score = score
-            if depth == DEPTH:
-                next_move = move
-        game_state.undoMove()
+            best_move = move
         if max_score > alpha:
             alpha = max_score
+            pv_table[ply] = [move] + pv_table[ply + 1]
         if alpha >= beta:
+            search_stats.cutoffs += 1
+            if move_number == 0:
+                search_stats.first_move_cutoffs += 1
+            if MOVE_ORDERING:
+                storeCutoff(move, depth, ply)
             break
+    if best_move is None and pruned:  # every move was futile
+        transposition_table.store(game_state.zobrist_key, depth, max_score, UPPER_BOUND, None)
+        return max_score
+    if best_move is None:  # no valid moves, checkmate or stalemate
+        score = turn_multiplier * scoreBoard(game_state)
+        transposition_table.store(game_state.zobrist_key, depth, score, EXACT, None)
+        return score
+    search_stats.interior_nodes += 1
+    if max_score <= alpha_original:
+        bound = UPPER_BOUND
+    elif max_score >= beta:
+        bound = LOWER_BOUND
+    else:
+        bound = EXACT
+    transposition_table.store(game_state.zobrist_key, depth, max_score, bound, best_move)
+    return max_score
+
+
+def quiescenceSearch(game_state, alpha, beta, turn_multiplier):
+    """
+    Search only captures and promotions below the horizon until the position is quiet, so that it isn't scored
+    in the middle of an exchange. The side to move may stand pat: take the static score instead of capturing.
+    Captures that can't bring the score up to alpha even with DELTA_MARGIN to spare are skipped (delta pruning).
+    In check all evasions are searched, as standing pat would be wrong there.
+    """
+    search_stats.quiescence_nodes += 1
+    checkLimits()
+    in_check = game_state.inCheck()
+    if in_check:
+        max_score = -CHECKMATE - 1
+        moves = game_state.generateMoves()
+    else:
+        stand_pat = turn_multiplier * scoreBoard(game_state)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        max_score = stand_pat
+        moves = game_state.generateMoves(captures_only=True)
+    for move in moves:
+        if not in_check and not move.is_pawn_promotion and \
+                stand_pat + ChessEvaluation.piece_score[move.piece_captured[1]] + DELTA_MARGIN <= alpha:
+            continue
+        game_state.makeMove(move)
+        score = -quiescenceSearch(game_state, -beta, -alpha, -turn_multiplier)
+        game_state.undoMove()
+        if search_aborted:
+            return 0
+        if score > max_score:
+            max_score = score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+    if game_state.checkmate or game_state.stalemate:  # the generator found no move at all
+        return turn_multiplier * scoreBoard(game_state)
     return max_score
 
 
+def bitbaseScore(game_state):
+    """
+    Score of a KQK, KRK or KPK position from the bitbases, None for any other position.
+    A win scores BITBASE_WIN plus the usual evaluation and a bonus for progress towards the mate the search can't
+    see yet: advancing the pawn, or driving the lone king to the edge with the other king close.
+    """
+    result = bitbases.probe(game_state)
+    if result is None or result == 0:
+        return result
+    if (result > 0) != game_state.white_to_move and game_state.inCheck():
+        if next(game_state.generateMoves(), None) is None:  # already mated, the generator set the flag
+            return scoreBoard(game_state)
+    piece, square = ChessBitbase.thirdPiece(game_state)
+    if piece[1] == "p":
+        progress = 6 - square // 8 if piece[0] == "w" else square // 8 - 1
+    else:
+        winner_row, winner_col = game_state.white_king_location if result > 0 else game_state.black_king_location
+        loser_row, loser_col = game_state.black_king_location if result > 0 else game_state.white_king_location
+        edge = max(3 - loser_row, loser_row - 4) + max(3 - loser_col, loser_col - 4)
+        progress = edge - 0.4 * (abs(winner_row - loser_row) + abs(winner_col - loser_col))
+    return taperedScore(game_state) + result * (BITBASE_WIN + 0.5 * progress)
+
+
 def scoreBoard(game_state):
     """
     Score the board. A positive score is good for white, a negative score is good for black.
     """
+    search_stats.evaluations += 1
     if game_state.checkmate:
         if game_state.white_to_move:
             return -CHECKMATE  # black wins
@@ -108,20 +1092,96 @@ def scoreBoard(game_state):
             return CHECKMATE  # white wins
     elif game_state.stalemate:
         return STALEMATE
+    score = taperedScore(game_state)
+    if DEBUG_EVALUATION:
+        full_score = scoreBoardFromScratch(game_state)
+        assert abs(score - full_score) < 1e-6, "incremental score %f != recomputed %f" % (score, full_score)
+    if PAWN_STRUCTURE:
+        score += pawnStructureScore(game_state)
+    return score
+
+
+def pawnStructureScore(game_state):
+    """
+    Score of the pawn structure, positive if it is better for white. Looked up in the pawn hash table by the pawn
+    key and only worked out with pawnStructureFromScratch when it isn't there.
+    """
+    score = pawn_table.probe(game_state.pawn_key)
+    if score is None:
+        score = pawnStructureFromScratch(game_state.board)
+        pawn_table.store(game_state.pawn_key, score)
+    return score
+
+
+def pawnStructureFromScratch(board):
+    """
+    Bonuses and penalties of the pawns on the board, positive is good for white:
+    doubled - another pawn of the same color is behind it on its file,
+    isolated - no pawn of the same color on the files next to it,
+    backward - the pawns on the files next to it are all ahead of it and an enemy pawn guards the square in front,
+    passed - no enemy pawn ahead of it on its own or the files next to it, worth more the further it has advanced.
+    """
+    rows = {"w": [[] for _ in range(8)], "b": [[] for _ in range(8)]}  # color -> rows of its pawns by column
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece[1] == "p":
+                rows[piece[0]][col].append(row)
     score = 0
+    for color, sign, forward in (("w", 1, -1), ("b", -1, 1)):
+        own, enemy = rows[color], rows["b" if color == "w" else "w"]
+        for col in range(8):
+            if not own[col]:
+                continue
+            score -= sign * DOUBLED_PAWN_PENALTY * (len(own[col]) - 1)
+            neighbours = [row for side in (col - 1, col + 1) if 0 <= side < 8 for row in own[side]]
+            for row in own[col]:
+                # (other - row) * forward > 0: the pawn on row other is ahead of this one
+                if not any((other - row) * forward > 0 for side in (col - 1, col, col + 1) if 0 <= side < 8
+                           for other in enemy[side]):
+                    score += sign * PASSED_PAWN_BONUS[6 - row if color == "w" else row - 1]
+                if not neighbours:
+                    score -= sign * ISOLATED_PAWN_PENALTY
+                elif all((other - row) * forward > 0 for other in neighbours) and \
+                        any(other == row + 2 * forward for side in (col - 1, col + 1) if 0 <= side < 8
+                            for other in enemy[side]):
+                    score -= sign * BACKWARD_PAWN_PENALTY
+    return score
+
+
+def taperedScore(game_state):
+    """
+    Material plus the middlegame and endgame piece-square totals of game_state mixed by its phase, all kept up to
+    date by makeMove. Promotions can take the phase above MAX_PHASE, the middlegame tables then count fully.
+    """
+    max_phase = ChessEvaluation.MAX_PHASE
+    phase = min(game_state.phase, max_phase)
+    return game_state.material_score + (game_state.position_score * phase +
+                                        game_state.endgame_position_score * (max_phase - phase)) / max_phase
+
+
+def scoreBoardFromScratch(game_state):
+    """
+    Material and tapered piece-square score of a non-terminal position by scanning the whole board.
+    """
+    score = middlegame_score = endgame_score = phase = 0
     for row in range(len(game_state.board)):
         for col in range(len(game_state.board[row])):
             piece = game_state.board[row][col]
             if piece != "--":
-                piece_position_score = 0
-                if piece[1] != "K":
-                    piece_position_score = piece_position_scores[piece][row][col]
+                phase += ChessEvaluation.piece_phase[piece[1]]
                 if piece[0] == "w":
-                    score += piece_score[piece[1]] + piece_position_score
+                    score += ChessEvaluation.piece_score[piece[1]]
+                    middlegame_score += ChessEvaluation.piece_position_scores[piece][row][col]
+                    endgame_score += ChessEvaluation.endgame_position_scores[piece][row][col]
                 if piece[0] == "b":
-                    score -= piece_score[piece[1]] + piece_position_score
+                    score -= ChessEvaluation.piece_score[piece[1]]
+                    middlegame_score -= ChessEvaluation.piece_position_scores[piece][row][col]
+                    endgame_score -= ChessEvaluation.endgame_position_scores[piece][row][col]
 
-    return score
+    max_phase = ChessEvaluation.MAX_PHASE
+    phase = min(phase, max_phase)
+    return score + (middlegame_score * phase + endgame_score * (max_phase - phase)) / max_phase
 
 
 def findRandomMove(valid_moves):
@@ -0,0 +1,157 @@
+"""
+Batch analysis - search every position of an EPD (or FEN) file with a fixed budget and write the results as EPD.
+
+The input is read one line at a time and only a bounded number of positions is in flight in the process pool,
+so memory stays flat however long the file is. Results are written in input order as soon as they are ready,
+each line being the position with the analysis appended as EPD operations:
+    pm  predicted move      pv  predicted variation     ce  centipawn score for the side to move
+    acd depth reached       acn nodes searched          acs seconds used
+Positions with a "bm" (best move) or "am" (avoid move) operation are counted as solved or not.
+
+Run it from this directory, e.g.:
+    python ChessAnalysis.py wac.epd --movetime 1000 --output wac-results.epd
+    python ChessAnalysis.py positions.fen --depth 4 --workers 8
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+import ChessAI
+import ChessBitboard
+import ChessBook
+
+EPD_OPERATION = re.compile(r'\s*(\w+)((?:\s+(?:"[^"]*"|[^\s;"]+))*)\s*;')
+MATE_SCORE = 32767  # largest EPD centipawn score, written for a forced mate
+PENDING_PER_WORKER = 4  # positions queued per worker process, enough to keep it busy
+
+
+def parseEpd(line):
+    """
+    (FEN, [(opcode, operand)]) of an EPD line. The move counters of a FEN line become hmvc and fmvn operations,
+    as EPD has them.
+    """
+    fields = line.split(None, 4)
+    rest = fields[4] if len(fields) > 4 else ""
+    counters = rest.split()
+    if len(counters) == 2 and counters[0].isdigit() and counters[1].isdigit():
+        operations = [("hmvc", counters[0]), ("fmvn", counters[1])]
+    else:
+        operations = [(opcode, operand.strip()) for opcode, operand in EPD_OPERATION.findall(rest)]
+    operands = dict(operations)
+    return " ".join(fields[:4] + [operands.get("hmvc", "0"), operands.get("fmvn", "1")]), operations
+
+
+def analysePosition(line, engine, search_options):
+    """
+    Search the position of one input line. Returns (output line, True/False if solved or None without bm/am).
+    """
+    fen, operations = parseEpd(line)
+    game_state = ChessBitboard.ENGINES[engine](fen)
+    valid_moves = game_state.getValidMoves()
+    if not valid_moves:
+        return line, None  # checkmate or stalemate, nothing to analyse
+    start_time = time.perf_counter()
+    # every position is searched, a book move would come without a score
+    move, stats = ChessAI.findBestMove(game_state, list(valid_moves), None, use_book=False, **search_options)
+    seconds = time.perf_counter() - start_time
+    operands = dict(operations)
+    solved = None
+    if "bm" in operands or "am" in operands:
+        best = [ChessBook.parseSan(san, valid_moves) for san in operands.get("bm", "").split()]
+        avoid = [ChessBook.parseSan(san, valid_moves) for san in operands.get("am", "").split()]
+        solved = (not best or move in best) and move not in avoid
+    variation = []
+    for pv_move in stats.principal_variation:  # played out, every move needs its position to be written down
+        moves = game_state.getValidMoves()
+        if pv_move not in moves:
+            break
+        variation.append(ChessBook.moveToSan(pv_move, moves))
+        game_state.makeMove(pv_move)
+    new_operations = [("pm", ChessBook.moveToSan(move, valid_moves)), ("pv", " ".join(variation)),
+                      ("ce", str(centipawns(stats.score))), ("acd", str(stats.depth)),
+                      ("acn", str(stats.nodes + stats.quiescence_nodes)), ("acs", "%.3f" % seconds)]
+    fields = fen.split()[:4]
+    return " ".join(fields + ["%s %s;" % (opcode, operand) if operand else opcode + ";"
+                              for opcode, operand in operations + new_operations]), solved
+
+
+def centipawns(score):
+    if abs(score) >= ChessAI.CHECKMATE:
+        return MATE_SCORE if score > 0 else -MATE_SCORE
+    return round(score * 100)
+
+
+def readPositions(file):
+    for line in file:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+def analyseFile(input_file, output_file, engine="bitboard", workers=1, **search_options):
+    """
+    Analyse every position of input_file, writing the result lines to output_file as they come.
+    Returns (positions, positions with bm/am, solved ones).
+    """
+    positions = tested = solved = 0
+
+    def write(result):
+        nonlocal positions, tested, solved
+        line, position_solved = result
+        output_file.write(line + "\n")
+        output_file.flush()
+        positions += 1
+        if position_solved is not None:
+            tested += 1
+            solved += position_solved
+
+    if workers <= 1:
+        for line in readPositions(input_file):
+            write(analysePosition(line, engine, search_options))
+        return positions, tested, solved
+    with multiprocessing.Pool(workers) as pool:
+        pending = collections.deque()
+        for line in readPositions(input_file):
+            pending.append(pool.apply_async(analysePosition, (line, engine, search_options)))
+            if len(pending) >= workers * PENDING_PER_WORKER:
+                write(pending.popleft().get())
+        while pending:
+            write(pending.popleft().get())
+    return positions, tested, solved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search every position of an EPD or FEN file.")
+    parser.add_argument("input", help="EPD or FEN file, one position per line, - for standard input")
+    parser.add_argument("--output", help="file to write the results to, standard output if not given")
+    parser.add_argument("--movetime", type=int, help="milliseconds per position")
+    parser.add_argument("--depth", type=int, default=ChessAI.DEPTH, help="maximum search depth")
+    parser.add_argument("--nodes", type=int, help="maximum nodes per position")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="positions searched at once")
+    parser.add_argument("--engine", choices=sorted(ChessBitboard.ENGINES), default="bitboard")
+    args = parser.parse_args(argv)
+
+    input_file = sys.stdin if args.input == "-" else open(args.input)
+    output_file = sys.stdout if args.output is None else open(args.output, "w")
+    start_time = time.perf_counter()
+    try:
+        positions, tested, solved = analyseFile(input_file, output_file, args.engine, args.workers,
+                                                movetime=args.movetime, max_depth=args.depth, max_nodes=args.nodes)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    summary = "%d positions in %.1fs" % (positions, time.perf_counter() - start_time)
+    if tested:
+        summary += ", %d/%d solved" % (solved, tested)
+    print(summary, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
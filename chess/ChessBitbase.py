@@ -0,0 +1,320 @@
+"""
+Endgame bitbases - whether king and queen, king and rook or king and pawn against a lone king (KQK, KRK, KPK)
+is won or drawn, for every placement of the three pieces and either side to move.
+
+Positions are stored with the stronger side as white (positions with black as the stronger side are looked up
+mirrored) under a perfect index of the piece squares:
+    index = black_to_move << 18 | white_king << 12 | black_king << 6 | piece
+with squares numbered row * 8 + col as in ChessBitboard. Every ending takes one bit per index, set if white wins,
+64 KB each, written one after the other to the file in ENDINGS order.
+
+The bitbases are generated once, offline, by retrograde analysis spread over a pool of processes:
+    python ChessBitbase.py --workers 8
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import ChessBitboard
+import ChessEngine
+
+ENDINGS = ("KQK", "KRK", "KPK")  # generation order, the KPK promotions are looked up in KQK and KRK
+BITBASE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bitbases.bin")
+POSITIONS = 2 << 18
+BLACK_TO_MOVE = 1 << 18
+TABLE_BYTES = POSITIONS // 8
+
+# generation states of a position
+UNKNOWN = 0
+WIN = 1
+INVALID = 2
+
+KING_TARGETS = [tuple(row * 8 + col for row, col in ChessEngine.KING_SQUARES[square // 8][square % 8])
+                for square in range(64)]
+KING_ZONES = ChessBitboard.KING_ATTACKS
+SQUARE_RAYS = [[tuple(row * 8 + col for row, col in ray) for ray in ChessEngine.RAYS[square // 8][square % 8]]
+               for square in range(64)]  # orthogonal rays first, like ChessEngine.DIRECTIONS
+PIECE_RAYS = {"Q": [rays for rays in SQUARE_RAYS], "R": [rays[:4] for rays in SQUARE_RAYS]}
+WHITE_PAWN_ATTACKS = ChessBitboard.PAWN_ATTACKS["w"]
+
+
+def _between():
+    """
+    between[a][b]: bitboard of the squares strictly between a and b if they share a line, else None.
+    """
+    between = [[None] * 64 for _ in range(64)]
+    for start in range(64):
+        for ray in SQUARE_RAYS[start]:
+            squares = 0
+            for end in ray:
+                between[start][end] = squares
+                squares |= 1 << end
+    return between
+
+
+BETWEEN = _between()
+ORTHOGONAL = [[start // 8 == end // 8 or start % 8 == end % 8 for end in range(64)] for start in range(64)]
+
+
+def positionIndex(black_to_move, white_king, black_king, piece):
+    return black_to_move << 18 | white_king << 12 | black_king << 6 | piece
+
+
+def attacks(piece_type, piece, square, blocker):
+    """
+    True if the white piece of piece_type on piece attacks square, with a blocker (the white king) on the board.
+    """
+    if piece_type == "P":
+        return WHITE_PAWN_ATTACKS[piece] >> square & 1
+    between = BETWEEN[piece][square]
+    if between is None or (piece_type == "R" and not ORTHOGONAL[piece][square]):
+        return False
+    return not between >> blocker & 1
+
+
+class Generator:
+    """
+    Retrograde analysis of one ending. The state of every position (UNKNOWN, WIN, INVALID) lives in shared memory,
+    the worker processes read it and report new wins, which the main process writes.
+    promotions: for KPK, the finished KQK and KRK tables to look the promotions up in.
+    """
+
+    def __init__(self, ending, state, promotions=None):
+        self.piece_type = ending[1]
+        self.state = state
+        self.promotions = promotions
+
+    def classify(self, start, end):
+        """
+        Mark the invalid positions among start..end and return the ones that are won at once:
+        black checkmated, or (KPK) white promoting to a won KQK or KRK position.
+        """
+        state = self.state
+        piece_type = self.piece_type
+        wins = []
+        for index in range(start, end):
+            black_to_move, white_king, black_king, piece = index >> 18, index >> 12 & 63, index >> 6 & 63, index & 63
+            if white_king == black_king or piece == white_king or piece == black_king or \
+                    KING_ZONES[white_king] >> black_king & 1 or (piece_type == "P" and piece // 8 in (0, 7)):
+                state[index] = INVALID
+            elif not black_to_move:
+                if attacks(piece_type, piece, black_king, white_king):
+                    state[index] = INVALID  # black left his king in check
+                elif piece_type == "P" and piece // 8 == 1 and self.promotionWins(white_king, black_king, piece - 8):
+                    wins.append(index)
+            elif self.blackResult(white_king, black_king, piece, mates_only=True):
+                wins.append(index)
+        return wins
+
+    def promotionWins(self, white_king, black_king, square):
+        if square == white_king or square == black_king:
+            return False
+        index = positionIndex(1, white_king, black_king, square)
+        return any(table[index >> 3] >> (index & 7) & 1 for table in self.promotions)
+
+    def blackResult(self, white_king, black_king, piece, mates_only=False):
+        """
+        True if white wins with black to move: every black move leads to a won position, or black is mated.
+        """
+        piece_type = self.piece_type
+        state = self.state
+        has_move = False
+        for square in KING_TARGETS[black_king]:
+            if KING_ZONES[white_king] >> square & 1:
+                continue
+            if square == piece:
+                return False  # the piece isn't defended, the capture draws
+            if attacks(piece_type, piece, square, white_king):
+                continue
+            if mates_only or state[positionIndex(0, white_king, square, piece)] != WIN:
+                return False
+            has_move = True
+        return has_move or bool(attacks(piece_type, piece, black_king, white_king))
+
+    def whitePredecessors(self, wins):
+        """
+        White-to-move positions with a move into one of the won black-to-move positions, which makes them won.
+        """
+        state = self.state
+        new_wins = set()
+        for index in wins:
+            white_king, black_king, piece = index >> 12 & 63, index >> 6 & 63, index & 63
+            candidates = [positionIndex(0, square, black_king, piece) for square in KING_TARGETS[white_king]]
+            if self.piece_type == "P":
+                if piece // 8 < 6:
+                    candidates.append(positionIndex(0, white_king, black_king, piece + 8))
+                    if piece // 8 == 4 and piece + 8 not in (white_king, black_king):
+                        candidates.append(positionIndex(0, white_king, black_king, piece + 16))
+            else:
+                for ray in PIECE_RAYS[self.piece_type][piece]:
+                    for square in ray:
+                        if square == white_king or square == black_king:
+                            break
+                        candidates.append(positionIndex(0, white_king, black_king, square))
+            for candidate in candidates:
+                if state[candidate] == UNKNOWN:
+                    new_wins.add(candidate)
+        return list(new_wins)
+
+    def blackPredecessors(self, wins):
+        """
+        Black-to-move positions with a move into one of the won white-to-move positions that are now won,
+        because all their other moves are won for white too.
+        """
+        state = self.state
+        new_wins = set()
+        for index in wins:
+            white_king, black_king, piece = index >> 12 & 63, index >> 6 & 63, index & 63
+            for square in KING_TARGETS[black_king]:
+                candidate = positionIndex(1, white_king, square, piece)
+                if state[candidate] == UNKNOWN and candidate not in new_wins and \
+                        self.blackResult(white_king, square, piece):
+                    new_wins.add(candidate)
+        return list(new_wins)
+
+
+generator = None  # Generator of a worker process
+
+
+def initWorker(ending, state, promotions):
+    global generator
+    generator = Generator(ending, state, promotions)
+
+
+def runWorker(method, *args):
+    return getattr(generator, method)(*args)
+
+
+def generate(ending, workers, promotions=None, log=None):
+    """
+    Generate the bitbase of the ending and return it bit-packed.
+    """
+    state = multiprocessing.RawArray("b", POSITIONS)
+    chunks = workers * 4
+
+    def runAll(pool, method, jobs):
+        if pool is None:
+            results = [runWorker(method, *job) for job in jobs]
+        else:
+            results = pool.starmap(runWorker, [(method,) + job for job in jobs])
+        return sorted(set(index for result in results for index in result))
+
+    def split(items):
+        size = max(1, -(-len(items) // chunks))
+        return [(items[start:start + size],) for start in range(0, len(items), size)]
+
+    initWorker(ending, state, promotions)
+    pool = multiprocessing.Pool(workers, initializer=initWorker, initargs=(ending, state, promotions)) \
+        if workers > 1 else None
+    try:
+        step = -(-POSITIONS // chunks)
+        wins = runAll(pool, "classify", [(start, min(start + step, POSITIONS)) for start in range(0, POSITIONS, step)])
+        plies = 0
+        while wins:
+            for index in wins:
+                state[index] = WIN
+            black_wins = [index for index in wins if index & BLACK_TO_MOVE]
+            white_wins = [index for index in wins if not index & BLACK_TO_MOVE]
+            # the new black wins make their white predecessors won, the new white wins may do it for black ones
+            new_white_wins = runAll(pool, "whitePredecessors", split(black_wins))
+            for index in new_white_wins:
+                state[index] = WIN
+            wins = runAll(pool, "blackPredecessors", split(white_wins + new_white_wins))
+            plies += 2
+            if log is not None:
+                log("%s: %d plies, %d new wins" % (ending, plies, len(new_white_wins) + len(wins)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    table = bytearray(TABLE_BYTES)
+    for index in range(POSITIONS):
+        if state[index] == WIN:
+            table[index >> 3] |= 1 << (index & 7)
+    return bytes(table)
+
+
+def generateAll(path=BITBASE_FILE, workers=None, log=None):
+    """
+    Generate every ending and write them to path.
+    """
+    workers = workers or os.cpu_count() or 1
+    tables = {}
+    for ending in ENDINGS:
+        promotions = (tables["KQK"], tables["KRK"]) if ending == "KPK" else None
+        tables[ending] = generate(ending, workers, promotions, log)
+    with open(path, "wb") as file:
+        for ending in ENDINGS:
+            file.write(tables[ending])
+    return tables
+
+
+class Bitbases:
+    """
+    The generated bitbases, read from the file.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            data = file.read()
+        self.tables = {ending: data[number * TABLE_BYTES:(number + 1) * TABLE_BYTES]
+                       for number, ending in enumerate(ENDINGS)}
+
+    def probe(self, game_state):
+        """
+        1 if white wins, -1 if black wins, 0 if it's a draw, None if the position isn't one of the ENDINGS.
+        Only call it with three pieces on the board (GameState.piece_count).
+        """
+        piece, square = thirdPiece(game_state)
+        if piece is None:
+            return None
+        white_king = game_state.white_king_location[0] * 8 + game_state.white_king_location[1]
+        black_king = game_state.black_king_location[0] * 8 + game_state.black_king_location[1]
+        table = self.tables["K" + piece[1].upper() + "K"]
+        black_to_move = not game_state.white_to_move
+        if piece[0] == "b":  # mirror the board, so that the stronger side is white
+            white_king, black_king, square = black_king ^ 56, white_king ^ 56, square ^ 56
+            black_to_move = not black_to_move
+        index = positionIndex(black_to_move, white_king, black_king, square)
+        if not table[index >> 3] >> (index & 7) & 1:
+            return 0
+        return 1 if piece[0] == "w" else -1
+
+
+def thirdPiece(game_state):
+    """
+    (piece, square) of the queen, rook or pawn next to the kings, (None, None) if there is none.
+    """
+    for row in range(8):
+        for col in range(8):
+            if game_state.board[row][col][1] in "QRp":
+                return game_state.board[row][col], row * 8 + col
+    return None, None
+
+
+def openBitbases(path=BITBASE_FILE):
+    """
+    The Bitbases at path, or None if they weren't generated.
+    """
+    if not os.path.exists(path):
+        return None
+    return Bitbases(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the KQK, KRK and KPK endgame bitbases.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes to generate with")
+    parser.add_argument("--output", default=BITBASE_FILE)
+    args = parser.parse_args(argv)
+    start_time = time.perf_counter()
+    tables = generateAll(args.output, args.workers, print)
+    for ending in ENDINGS:
+        print("%s: %d won positions" % (ending, sum(bin(byte).count("1") for byte in tables[ending])))
+    print("written to %s in %.1fs" % (args.output, time.perf_counter() - start_time))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Opening book - moves played from known positions, so the engine doesn't have to search the opening.
+
+The book file is an array of 16 byte entries sorted by position key, each (big-endian):
+    key     8 bytes   Zobrist key of the position (GameState.zobrist_key)
+    move    2 bytes   moveID of the move played from it
+    weight  2 bytes   how often it was played, moves are picked with this probability
+    unused  4 bytes
+The file is read through mmap and looked up with a binary search, so opening it costs nothing and its pages are
+shared by every process that reads it.
+
+Build a book from a PGN file and look at it from this directory, e.g.:
+    python ChessBook.py build games.pgn book.bin --plies 16
+    python ChessBook.py probe book.bin --fen "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1"
+"""
+import argparse
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+
+import ChessBitboard
+
+ENTRY = struct.Struct(">QHHI")
+MAX_WEIGHT = 0xFFFF
+
+PGN_TAG = re.compile(r"^\[.*\]\s*$", re.MULTILINE)
+PGN_COMMENT = re.compile(r"\{[^}]*\}|;[^\n]*")
+PGN_VARIATION = re.compile(r"\([^()]*\)")
+PGN_RESULT = re.compile(r"^(1-0|0-1|1/2-1/2|\*)$")
+PGN_MOVE_NUMBER = re.compile(r"^\d+\.+")
+SAN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+
+
+class OpeningBook:
+    """
+    Read-only view of a book file. Close it when done, or use it as a context manager.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            # an empty file can't be mapped, but it is a valid book without entries
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(file.fileno()).st_size \
+                else b""
+        self.size = len(self.data) // ENTRY.size
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def keyAt(self, index):
+        return ENTRY.unpack_from(self.data, index * ENTRY.size)[0]
+
+    def lookup(self, key):
+        """
+        [(moveID, weight)] of the position with the Zobrist key, empty if it isn't in the book.
+        """
+        low, high = 0, self.size
+        while low < high:  # first entry with a key not less than key
+            middle = (low + high) // 2
+            if self.keyAt(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        for index in range(low, self.size):
+            entry_key, move_id, weight, _ = ENTRY.unpack_from(self.data, index * ENTRY.size)
+            if entry_key != key:
+                break
+            entries.append((move_id, weight))
+        return entries
+
+    def findMove(self, game_state, valid_moves, rng=random):
+        """
+        A book move of the current position picked with probability proportional to its weight,
+        or None if the position isn't in the book. Pass a seeded random.Random as rng to repeat the choices.
+        """
+        moves_by_id = {move.moveID: move for move in valid_moves}
+        # a key collision or a book built for another move encoding could give moves that aren't legal here
+        candidates = [(moves_by_id[move_id], weight) for move_id, weight in self.lookup(game_state.zobrist_key)
+                      if move_id in moves_by_id and weight > 0]
+        if not candidates:
+            return None
+        pick = rng.random() * sum(weight for _, weight in candidates)
+        for move, weight in candidates:
+            pick -= weight
+            if pick < 0:
+                return move
+        return candidates[-1][0]
+
+
+def openBook(path):
+    """
+    The OpeningBook at path, or None if there is no such file.
+    """
+    if not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+
+def parseSan(san, valid_moves):
+    """
+    The move of valid_moves written as san (standard algebraic notation, e.g. Nbd7, exd5, e8=Q, O-O), or None.
+    """
+    san = san.rstrip("+#!?")
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        end_col = 6 if len(san) == 3 else 2
+        for move in valid_moves:
+            if move.is_castle_move and move.end_col == end_col:
+                return move
+        return None
+    match = SAN.match(san)
+    if match is None:
+        return None
+    piece, from_file, from_rank, square, promotion = match.groups()
+    piece = piece or "p"
+    end_row, end_col = 8 - int(square[1]), ord(square[0]) - ord("a")
+    found = None
+    for move in valid_moves:
+        if move.piece_moved[1] != piece or move.end_row != end_row or move.end_col != end_col:
+            continue
+        if from_file is not None and move.start_col != ord(from_file) - ord("a"):
+            continue
+        if from_rank is not None and move.start_row != 8 - int(from_rank):
+            continue
+        if move.is_pawn_promotion and move.promotion_piece != (promotion or "Q"):
+            continue
+        if found is not None:
+            return None  # ambiguous
+        found = move
+    return found
+
+
+def moveToSan(move, valid_moves):
+    """
+    Standard algebraic notation of the move, disambiguated among valid_moves (without the check sign).
+    """
+    if move.is_castle_move:
+        return "O-O" if move.end_col == 6 else "O-O-O"
+    square = move.getRankFile(move.end_row, move.end_col)
+    if move.piece_moved[1] == "p":
+        san = (move.cols_to_files[move.start_col] + "x" if move.is_capture else "") + square
+        return san + "=" + move.promotion_piece if move.is_pawn_promotion else san
+    others = [other for other in valid_moves if other.piece_moved == move.piece_moved and
+              other.end_row == move.end_row and other.end_col == move.end_col and other != move]
+    origin = ""
+    if others:
+        if all(other.start_col != move.start_col for other in others):
+            origin = move.cols_to_files[move.start_col]
+        elif all(other.start_row != move.start_row for other in others):
+            origin = move.rows_to_ranks[move.start_row]
+        else:
+            origin = move.getRankFile(move.start_row, move.start_col)
+    return move.piece_moved[1] + origin + ("x" if move.is_capture else "") + square
+
+
+def readPgnGames(file):
+    """
+    Yield the moves (SAN strings) of every game in a PGN file, without comments, variations and annotations.
+    """
+    text = PGN_TAG.sub(" ", PGN_COMMENT.sub(" ", file.read()))
+    previous = None
+    while previous != text:  # innermost variations first
+        previous = text
+        text = PGN_VARIATION.sub(" ", text)
+    moves = []
+    for token in text.split():
+        token = PGN_MOVE_NUMBER.sub("", token)
+        if PGN_RESULT.match(token):  # every game ends with its result
+            if moves:
+                yield moves
+            moves = []
+        elif token and not token.startswith("$"):
+            moves.append(token)
+    if moves:
+        yield moves
+
+
+def buildBook(pgn_path, book_path, plies=16, min_games=1):
+    """
+    Compile the first plies moves of every game in the PGN file into a book file.
+    Moves played in fewer than min_games games are left out. Returns (games read, entries written).
+    """
+    counts = {}  # (key, moveID) -> games
+    games = 0
+    with open(pgn_path, encoding="utf-8", errors="replace") as file:
+        for san_moves in readPgnGames(file):
+            games += 1
+            game_state = ChessBitboard.BitboardGameState()
+            game_state.underpromotions = True
+            for san in san_moves[:plies]:
+                move = parseSan(san, game_state.getValidMoves())
+                if move is None:
+                    print("Game %d: can't play %s, skipping the rest of it." % (games, san), file=sys.stderr)
+                    break
+                entry = (game_state.zobrist_key, move.moveID)
+                counts[entry] = counts.get(entry, 0) + 1
+                game_state.makeMove(move)
+    entries = sorted((key, move_id, count) for (key, move_id), count in counts.items() if count >= min_games)
+    scale = max([count for _, _, count in entries] + [MAX_WEIGHT]) / MAX_WEIGHT
+    with open(book_path, "wb") as file:
+        for key, move_id, count in entries:
+            file.write(ENTRY.pack(key, move_id, max(1, round(count / scale)), 0))
+    return games, len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or look into an opening book.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile a book from a PGN file")
+    build.add_argument("pgn")
+    build.add_argument("book")
+    build.add_argument("--plies", type=int, default=16, help="moves of every game that go into the book")
+    build.add_argument("--min-games", type=int, default=1, help="leave out moves played in fewer games")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", help="position to look up, the starting position if not given")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        games, entries = buildBook(args.pgn, args.book, args.plies, args.min_games)
+        print("%d games, %d book entries written to %s" % (games, entries, args.book))
+        return 0
+    game_state = ChessBitboard.BitboardGameState(args.fen)
+    moves_by_id = {move.moveID: move for move in game_state.getValidMoves()}
+    with OpeningBook(args.book) as book:
+        entries = book.lookup(game_state.zobrist_key)
+        total = sum(weight for _, weight in entries)
+        for move_id, weight in sorted(entries, key=lambda entry: -entry[1]):
+            print("%-8s %5d  %5.1f%%" % (moves_by_id.get(move_id, "?%d" % move_id), weight, 100 * weight / total))
+        if not entries:
+            print("position not in the book")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,15 +3,46 @@ Storing all the information about the current state of chess game.
 Determining valid moves at current state.
 It will keep move log.
 """
+import random
+import re
+import ChessEvaluation
+
+# Zobrist keys: one random 64-bit number per (piece, square), side to move, castling right and en-passant file.
+# The position key is the xor of the numbers of everything present, so a move changes it with a few xors.
+_zobrist_random = random.Random(20210603)
+ZOBRIST_PIECES = {color + piece: [_zobrist_random.getrandbits(64) for _ in range(64)]
+                  for color in "wb" for piece in "pRNBQK"}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_ENPASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]
+_zobrist_castling_rights = [_zobrist_random.getrandbits(64) for _ in range(4)]  # wks, bks, wqs, bqs
+ZOBRIST_CASTLING = [0] * 16  # indexed by wks | bks << 1 | wqs << 2 | bqs << 3
+for _rights in range(16):
+    for _right in range(4):
+        if _rights >> _right & 1:
+            ZOBRIST_CASTLING[_rights] ^= _zobrist_castling_rights[_right]
+
+# Squares seen from every board[row][col]: the knight and king jumps and the rays in every direction, walked outwards.
+# Attacks on a square are found by looking from that square for the pieces that could reach it.
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))  # orthogonal ones first
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+KNIGHT_SQUARES = [[tuple((row + d_row, col + d_col) for d_row, d_col in KNIGHT_OFFSETS
+                         if 0 <= row + d_row <= 7 and 0 <= col + d_col <= 7) for col in range(8)] for row in range(8)]
+KING_SQUARES = [[tuple((row + d_row, col + d_col) for d_row, d_col in KING_OFFSETS
+                       if 0 <= row + d_row <= 7 and 0 <= col + d_col <= 7) for col in range(8)] for row in range(8)]
+RAYS = [[tuple(tuple((row + d_row * i, col + d_col * i) for i in range(1, 8)
+                     if 0 <= row + d_row * i <= 7 and 0 <= col + d_col * i <= 7) for d_row, d_col in DIRECTIONS)
+         for col in range(8)] for row in range(8)]
 
 
 class GameState:
-    def __init__(self):
+    def __init__(self, fen=None):
         """
         Board is an 8x8 2d list, each element in list has 2 characters.
         The first character represents the color of the piece: 'b' or 'w'.
         The second character represents the type of the piece: 'R', 'N', 'B', 'Q', 'K' or 'p'.
         "--" represents an empty space with no piece.
+        If a FEN string is given, the game starts from that position instead of the initial one.
         """
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
@@ -34,19 +65,217 @@ class GameState:
         self.pins = []
         self.checks = []
         self.enpassant_possible = ()  # coordinates for the square where en-passant capture is possible
-        self.enpassant_possible_log = [self.enpassant_possible]
         self.current_castling_rights = CastleRights(True, True, True, True)
+        self.underpromotions = False  # if True, promotions to rook, bishop and knight are generated too
+        self.halfmove_clock = 0  # plies since the last capture or pawn move, for the fifty-move rule
+        self.fullmove_number = 1  # starts at 1 and goes up after every black move
+        if fen is not None:
+            self.parseFen(fen)
+        self.enpassant_possible_log = [self.enpassant_possible]
+        self.halfmove_clock_log = [self.halfmove_clock]
         self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
                                                self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
+        self.zobrist_key = self.computeZobristKey()
+        self.zobrist_key_log = [self.zobrist_key]
+        self.pawn_key = self.computePawnKey()  # Zobrist key of the pawns alone, for ChessAI.pawn_table
+        self.pawn_key_log = [self.pawn_key]
+        # running evaluation terms, positive is good for white (see ChessAI.scoreBoard)
+        # the piece-square totals are kept for the middlegame and the endgame tables, phase goes down from
+        # ChessEvaluation.MAX_PHASE as pieces leave the board and sets the mix of the two
+        self.material_score, self.position_score, self.endgame_position_score, self.phase = self.computeScores()
+        self.score_log = [(self.material_score, self.position_score, self.endgame_position_score, self.phase)]
+        self.piece_count = sum(piece != "--" for row in self.board for piece in row)  # kings included
+        # bitmaps of the squares attacked by each color, valid while zobrist_key equals attack_maps_key
+        self.attack_maps = {}
+        self.attack_maps_key = None
+
+    def parseFen(self, fen):
+        """
+        Set up the board, side to move, castling rights and en-passant square from a FEN string.
+        Raises ValueError if the FEN is malformed or either side does not have exactly one king.
+        """
+        fields = fen.split()
+        if not fields or len(fields) > 6:
+            raise ValueError("FEN must have 1 to 6 fields: %r" % fen)
+        ranks = fields[0].split("/")
+        if len(ranks) != 8:
+            raise ValueError("FEN board must have 8 ranks: %r" % fields[0])
+        self.board = []
+        kings = {"w": 0, "b": 0}
+        for rank in ranks:
+            row = []
+            for char in rank:
+                if char in "12345678":
+                    row.extend(["--"] * int(char))
+                elif char in "PNBRQKpnbrqk":
+                    color = "w" if char.isupper() else "b"
+                    piece = "p" if char in "Pp" else char.upper()
+                    if piece == "K":
+                        kings[color] += 1
+                        if color == "w":
+                            self.white_king_location = (len(self.board), len(row))
+                        else:
+                            self.black_king_location = (len(self.board), len(row))
+                    row.append(color + piece)
+                else:
+                    raise ValueError("bad character %r in FEN board" % char)
+            if len(row) != 8:
+                raise ValueError("FEN rank must have 8 squares: %r" % rank)
+            self.board.append(row)
+        if kings != {"w": 1, "b": 1}:
+            raise ValueError("FEN board must have exactly one king per side: %r" % fields[0])
+        side = fields[1] if len(fields) > 1 else "w"
+        if side not in ("w", "b"):
+            raise ValueError("FEN side to move must be w or b: %r" % side)
+        self.white_to_move = side == "w"
+        castling = fields[2] if len(fields) > 2 else "-"
+        if castling != "-" and (not castling or any(castling.count(char) > 1 or char not in "KQkq"
+                                                    for char in castling)):
+            raise ValueError("FEN castling rights must be - or a subset of KQkq: %r" % castling)
+        self.current_castling_rights = CastleRights("K" in castling, "k" in castling, "Q" in castling, "q" in castling)
+        enpassant = fields[3] if len(fields) > 3 else "-"
+        self.enpassant_possible = ()
+        if enpassant != "-":
+            if not re.fullmatch("[a-h][36]", enpassant) or (enpassant[1] == "6") != self.white_to_move:
+                raise ValueError("FEN en-passant square must be - or a square on rank 3 or 6: %r" % enpassant)
+            row, col = Move.ranks_to_rows[enpassant[1]], Move.files_to_cols[enpassant[0]]
+            # the pushed pawn is one square past the en-passant square, as seen by the side that pushed it
+            pawn_row = row + 1 if self.white_to_move else row - 1
+            if self.canCaptureEnpassant(pawn_row, col, "w" if self.white_to_move else "b"):
+                self.enpassant_possible = (row, col)
+        # the move counters are optional, EPD lines don't have them
+        try:
+            self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+            self.fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("FEN move counters must be numbers: %r" % " ".join(fields[4:])) from None
+        if self.halfmove_clock < 0 or self.fullmove_number < 1:
+            raise ValueError("FEN move counters out of range: %r" % " ".join(fields[4:]))
+
+    def canCaptureEnpassant(self, pawn_row, pawn_col, color):
+        """
+        True if a pawn of color stands next to the pawn on (pawn_row, pawn_col) and so could take it en-passant.
+        The en-passant square is only set (and hashed) then, so that positions that only differ by an
+        en-passant square nobody can use get the same FEN and Zobrist key.
+        """
+        return any(0 <= col < 8 and self.board[pawn_row][col] == color + "p" for col in (pawn_col - 1, pawn_col + 1))
+
+    def getFen(self):
+        """
+        The current position as a FEN string.
+        """
+        rows = []
+        for row in self.board:
+            fen_row = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    fen_row += str(empty)
+                    empty = 0
+                fen_row += piece[1].upper() if piece[0] == "w" else piece[1].lower()
+            rows.append(fen_row + (str(empty) if empty else ""))
+        rights = self.current_castling_rights
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + ("k" if rights.bks else "") + (
+            "q" if rights.bqs else "")
+        if self.enpassant_possible:
+            enpassant = Move.cols_to_files[self.enpassant_possible[1]] + Move.rows_to_ranks[self.enpassant_possible[0]]
+        else:
+            enpassant = "-"
+        return "%s %s %s %s %d %d" % ("/".join(rows), "w" if self.white_to_move else "b", castling or "-", enpassant,
+                                      self.halfmove_clock, self.fullmove_number)
+
+    def computeScores(self):
+        """
+        Compute the material, middlegame and endgame piece-square totals and the game phase of the current
+        position from scratch.
+        """
+        material_score = position_score = endgame_position_score = phase = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    material_score += ChessEvaluation.material_values[piece]
+                    position_score += ChessEvaluation.position_values[piece][row * 8 + col]
+                    endgame_position_score += ChessEvaluation.endgame_position_values[piece][row * 8 + col]
+                    phase += ChessEvaluation.phase_values[piece]
+        return material_score, position_score, endgame_position_score, phase
+
+    def computeZobristKey(self):
+        """
+        Compute the Zobrist key of the current position from scratch.
+        """
+        key = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][row * 8 + col]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.enpassant_possible:
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        return key ^ ZOBRIST_CASTLING[self.current_castling_rights.index()]
+
+    def computePawnKey(self):
+        """
+        Compute the pawn-only Zobrist key of the current position from scratch.
+        """
+        key = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece[1] == "p":
+                    key ^= ZOBRIST_PIECES[piece][row * 8 + col]
+        return key
 
     def makeMove(self, move):
         """
         Takes a Move as a parameter and executes it.
         (this will not work for castling, pawn promotion and en-passant)
         """
+        # xor out the old en-passant file and castling rights, the new ones are xored in at the end
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[self.current_castling_rights.index()]
+        if self.enpassant_possible:
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        key ^= ZOBRIST_PIECES[move.piece_moved][move.start_row * 8 + move.start_col]
+        pawn_key = self.pawn_key
+        if move.piece_moved[1] == "p":
+            pawn_key ^= ZOBRIST_PIECES[move.piece_moved][move.start_row * 8 + move.start_col]
+        material_values = ChessEvaluation.material_values
+        position_values = ChessEvaluation.position_values
+        endgame_position_values = ChessEvaluation.endgame_position_values
+        material_score = self.material_score - material_values[move.piece_moved]
+        position_score = self.position_score - position_values[move.piece_moved][move.start_row * 8 + move.start_col]
+        endgame_position_score = self.endgame_position_score - \
+            endgame_position_values[move.piece_moved][move.start_row * 8 + move.start_col]
+        phase = self.phase
+        if move.piece_captured != "--":
+            if move.is_enpassant_move:
+                captured_square = move.start_row * 8 + move.end_col
+            else:
+                captured_square = move.end_row * 8 + move.end_col
+            key ^= ZOBRIST_PIECES[move.piece_captured][captured_square]
+            if move.piece_captured[1] == "p":
+                pawn_key ^= ZOBRIST_PIECES[move.piece_captured][captured_square]
+            material_score -= material_values[move.piece_captured]
+            position_score -= position_values[move.piece_captured][captured_square]
+            endgame_position_score -= endgame_position_values[move.piece_captured][captured_square]
+            phase -= ChessEvaluation.phase_values[move.piece_captured]
+            self.piece_count -= 1
+
         self.board[move.start_row][move.start_col] = "--"
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.move_log.append(move)  # log the move so we can undo it later
+        if move.piece_moved[1] == "p" or move.piece_captured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        self.halfmove_clock_log.append(self.halfmove_clock)
+        if not self.white_to_move:
+            self.fullmove_number += 1
         self.white_to_move = not self.white_to_move  # switch players
         # update king's location if moved
         if move.piece_moved == "wK":
@@ -60,14 +289,15 @@ class GameState:
             #    promoted_piece = input("Promote to Q, R, B, or N:") #take this to UI later
             #    self.board[move.end_row][move.end_col] = move.piece_moved[0] + promoted_piece
             # else:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + "Q"
+            self.board[move.end_row][move.end_col] = move.piece_moved[0] + move.promotion_piece
 
         # enpassant move
         if move.is_enpassant_move:
             self.board[move.start_row][move.end_col] = "--"  # capturing the pawn
 
         # update enpassant_possible variable
-        if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:  # only on 2 square pawn advance
+        if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2 and \
+                self.canCaptureEnpassant(move.end_row, move.end_col, "w" if self.white_to_move else "b"):
             self.enpassant_possible = ((move.start_row + move.end_row) // 2, move.start_col)
         else:
             self.enpassant_possible = ()
@@ -82,6 +312,15 @@ class GameState:
                 self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][
                     move.end_col - 2]  # moves the rook to its new square
                 self.board[move.end_row][move.end_col - 2] = '--'  # erase old rook
+            if move.end_col - move.start_col == 2:
+                rook_start, rook_end = move.end_row * 8 + move.end_col + 1, move.end_row * 8 + move.end_col - 1
+            else:
+                rook_start, rook_end = move.end_row * 8 + move.end_col - 2, move.end_row * 8 + move.end_col + 1
+            rook = move.piece_moved[0] + "R"
+            key ^= ZOBRIST_PIECES[rook][rook_start] ^ ZOBRIST_PIECES[rook][rook_end]
+            position_score += position_values[rook][rook_end] - position_values[rook][rook_start]
+            endgame_position_score += \
+                endgame_position_values[rook][rook_end] - endgame_position_values[rook][rook_start]
 
         self.enpassant_possible_log.append(self.enpassant_possible)
 
@@ -90,6 +329,25 @@ class GameState:
         self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
                                                    self.current_castling_rights.wqs, self.current_castling_rights.bqs))
 
+        piece_placed = self.board[move.end_row][move.end_col]  # differs from piece_moved on promotion
+        key ^= ZOBRIST_PIECES[piece_placed][move.end_row * 8 + move.end_col]
+        if piece_placed[1] == "p":  # not on promotion, the pawn is gone
+            pawn_key ^= ZOBRIST_PIECES[piece_placed][move.end_row * 8 + move.end_col]
+        self.pawn_key = pawn_key
+        self.pawn_key_log.append(pawn_key)
+        self.material_score = material_score + material_values[piece_placed]
+        self.position_score = position_score + position_values[piece_placed][move.end_row * 8 + move.end_col]
+        self.endgame_position_score = endgame_position_score + \
+            endgame_position_values[piece_placed][move.end_row * 8 + move.end_col]
+        if move.is_pawn_promotion:
+            phase += ChessEvaluation.phase_values[piece_placed] - ChessEvaluation.phase_values[move.piece_moved]
+        self.phase = phase
+        self.score_log.append((self.material_score, self.position_score, self.endgame_position_score, phase))
+        if self.enpassant_possible:
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        self.zobrist_key = key ^ ZOBRIST_CASTLING[self.current_castling_rights.index()]
+        self.zobrist_key_log.append(self.zobrist_key)
+
     def undoMove(self):
         """
         Undo the last move
@@ -98,7 +356,13 @@ class GameState:
             move = self.move_log.pop()
             self.board[move.start_row][move.start_col] = move.piece_moved
             self.board[move.end_row][move.end_col] = move.piece_captured
+            if move.piece_captured != "--":
+                self.piece_count += 1
             self.white_to_move = not self.white_to_move  # swap players
+            if not self.white_to_move:
+                self.fullmove_number -= 1
+            self.halfmove_clock_log.pop()
+            self.halfmove_clock = self.halfmove_clock_log[-1]
             # update the king's position if needed
             if move.piece_moved == "wK":
                 self.white_king_location = (move.start_row, move.start_col)
@@ -112,10 +376,19 @@ class GameState:
             self.enpassant_possible_log.pop()
             self.enpassant_possible = self.enpassant_possible_log[-1]
 
+            self.zobrist_key_log.pop()
+            self.zobrist_key = self.zobrist_key_log[-1]
+            self.pawn_key_log.pop()
+            self.pawn_key = self.pawn_key_log[-1]
+            self.score_log.pop()
+            self.material_score, self.position_score, self.endgame_position_score, self.phase = self.score_log[-1]
+
             # undo castle rights
             self.castle_rights_log.pop()  # get rid of the new castle rights from the move we are undoing
-            self.current_castling_rights = self.castle_rights_log[
-                -1]  # set the current castle rights to the last one in the list
+            # set the current castle rights to a copy of the last one in the list
+            last_rights = self.castle_rights_log[-1]
+            self.current_castling_rights = CastleRights(last_rights.wks, last_rights.bks,
+                                                        last_rights.wqs, last_rights.bqs)
             # undo the castle move
             if move.is_castle_move:
                 if move.end_col - move.start_col == 2:  # king-side
@@ -127,16 +400,46 @@ class GameState:
             self.checkmate = False
             self.stalemate = False
 
+    def makeNullMove(self):
+        """
+        Pass the turn without moving, for the null-move pruning of the search. Undo it with undoNullMove.
+        """
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE
+        if self.enpassant_possible:
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        self.enpassant_possible = ()
+        self.enpassant_possible_log.append(self.enpassant_possible)
+        self.white_to_move = not self.white_to_move
+        self.zobrist_key = key
+        self.zobrist_key_log.append(key)
+
+    def undoNullMove(self):
+        self.white_to_move = not self.white_to_move
+        self.enpassant_possible_log.pop()
+        self.enpassant_possible = self.enpassant_possible_log[-1]
+        self.zobrist_key_log.pop()
+        self.zobrist_key = self.zobrist_key_log[-1]
+
+    def hasPieces(self, color):
+        """
+        True if color has anything besides the king and pawns - without it zugzwang is common.
+        """
+        for row in self.board:
+            for piece in row:
+                if piece[0] == color and piece[1] in "RNBQ":
+                    return True
+        return False
+
     def updateCastleRights(self, move):
         """
         Update the castle rights given the move
         """
-        if move.piece_captured == "wR":
+        if move.piece_captured == "wR" and move.end_row == 7:
             if move.end_col == 0:  # left rook
                 self.current_castling_rights.wqs = False
             elif move.end_col == 7:  # right rook
                 self.current_castling_rights.wks = False
-        elif move.piece_captured == "bR":
+        elif move.piece_captured == "bR" and move.end_row == 0:
             if move.end_col == 0:  # left rook
                 self.current_castling_rights.bqs = False
             elif move.end_col == 7:  # right rook
@@ -197,12 +500,11 @@ class GameState:
                         if valid_square[0] == check_row and valid_square[
                             1] == check_col:  # once you get to piece and check
                             break
-                # get rid of any moves that don't block check or move king
-                for i in range(len(moves) - 1, -1, -1):  # iterate through the list backwards when removing elements
-                    if moves[i].piece_moved[1] != "K":  # move doesn't move king so it must block or capture
-                        if not (moves[i].end_row,
-                                moves[i].end_col) in valid_squares:  # move doesn't block or capture piece
-                            moves.remove(moves[i])
+                # get rid of any moves that don't block check or move king, building a new list is O(n)
+                moves = [move for move in moves if
+                         move.piece_moved[1] == "K" or  # king moves were checked already
+                         (move.end_row, move.end_col) in valid_squares or  # move blocks or captures the checker
+                         (move.is_enpassant_move and (move.start_row, move.end_col) == (check_row, check_col))]
             else:  # double check, king has to move
                 self.getKingMoves(king_row, king_col, moves)
         else:  # not in check - all moves are fine
@@ -225,6 +527,40 @@ class GameState:
         self.current_castling_rights = temp_castle_rights
         return moves
 
+    def generateMoves(self, hash_move=None, quiet_key=None, captures_only=False):
+        """
+        Yield the valid moves in stages: the hash move, captures and promotions by most valuable victim /
+        least valuable attacker, then the quiet moves - sorted by quiet_key(moveID), highest first, when given.
+        With captures_only the hash move and the quiet moves are left out.
+        This board builds the whole list first, BitboardGameState creates the moves lazily.
+        """
+        moves = self.getValidMoves()
+        hash_move_id = -1
+        if hash_move is not None and not captures_only and hash_move in moves:
+            hash_move_id = hash_move.moveID
+            yield moves[moves.index(hash_move)]
+        mvv_lva_value = ChessEvaluation.mvv_lva_value
+        captures = []
+        quiets = []
+        for move in moves:
+            if move.moveID == hash_move_id:
+                continue
+            if move.is_capture:
+                captures.append((16 * mvv_lva_value[move.piece_captured[1]] - mvv_lva_value[move.piece_moved[1]] +
+                                 (16 * mvv_lva_value[move.promotion_piece] if move.is_pawn_promotion else 0), move))
+            elif move.is_pawn_promotion:
+                captures.append((16 * mvv_lva_value[move.promotion_piece], move))
+            else:
+                quiets.append(move)
+        captures.sort(key=lambda capture: capture[0], reverse=True)
+        for _, move in captures:
+            yield move
+        if captures_only:
+            return
+        if quiet_key is not None:
+            quiets.sort(key=lambda quiet: quiet_key(quiet.moveID), reverse=True)
+        yield from quiets
+
     def inCheck(self):
         """
         Determine if a current player is in check
@@ -236,16 +572,90 @@ class GameState:
 
     def squareUnderAttack(self, row, col):
         """
-        Determine if enemy can attack the square row col
+        Determine if enemy can attack the square row col.
+        Looks outwards from the square for an enemy knight, king or pawn on the squares they would attack it from
+        and for the first piece on every ray being a matching slider, so no moves are generated.
         """
-        self.white_to_move = not self.white_to_move  # switch to opponent's point of view
-        opponents_moves = self.getAllPossibleMoves()
-        self.white_to_move = not self.white_to_move
-        for move in opponents_moves:
-            if move.end_row == row and move.end_col == col:  # square is under attack
+        board = self.board
+        enemy_color = "b" if self.white_to_move else "w"
+        knight = enemy_color + "N"
+        for end_row, end_col in KNIGHT_SQUARES[row][col]:
+            if board[end_row][end_col] == knight:
+                return True
+        king = enemy_color + "K"
+        for end_row, end_col in KING_SQUARES[row][col]:
+            if board[end_row][end_col] == king:
+                return True
+        pawn_row = row + 1 if enemy_color == "w" else row - 1  # pawns attack the square from behind it
+        if 0 <= pawn_row <= 7:
+            pawn = enemy_color + "p"
+            if (col > 0 and board[pawn_row][col - 1] == pawn) or (col < 7 and board[pawn_row][col + 1] == pawn):
                 return True
+        orthogonal_sliders = (enemy_color + "R", enemy_color + "Q")
+        diagonal_sliders = (enemy_color + "B", enemy_color + "Q")
+        for j, ray in enumerate(RAYS[row][col]):
+            sliders = orthogonal_sliders if j < 4 else diagonal_sliders
+            for end_row, end_col in ray:
+                end_piece = board[end_row][end_col]
+                if end_piece != "--":
+                    if end_piece in sliders:
+                        return True
+                    break
         return False
 
+    def attackedSquares(self, color):
+        """
+        Bitmap of the squares attacked by the pieces of color, bit row * 8 + col.
+        It is computed once per position and side, then every query is a bit test.
+        """
+        if self.attack_maps_key != self.zobrist_key:
+            self.attack_maps = {}
+            self.attack_maps_key = self.zobrist_key
+        attacked = self.attack_maps.get(color)
+        if attacked is None:
+            attacked = self.attack_maps[color] = self.computeAttackedSquares(color)
+        return attacked
+
+    def computeAttackedSquares(self, color):
+        """
+        Bitmap of the squares attacked by the pieces of color.
+        Sliders see through the enemy king, so the squares behind it on a checking line count as attacked
+        and the king can't step back along that line.
+        """
+        board = self.board
+        enemy_king = ("b" if color == "w" else "w") + "K"
+        pawn_row_step = -1 if color == "w" else 1
+        attacked = 0
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if piece[0] != color:
+                    continue
+                piece_type = piece[1]
+                if piece_type == "p":
+                    end_row = row + pawn_row_step
+                    if 0 <= end_row <= 7:
+                        if col > 0:
+                            attacked |= 1 << (end_row * 8 + col - 1)
+                        if col < 7:
+                            attacked |= 1 << (end_row * 8 + col + 1)
+                elif piece_type == "N" or piece_type == "K":
+                    for end_row, end_col in (KNIGHT_SQUARES if piece_type == "N" else KING_SQUARES)[row][col]:
+                        attacked |= 1 << (end_row * 8 + end_col)
+                else:
+                    rays = RAYS[row][col]
+                    if piece_type == "R":
+                        rays = rays[:4]
+                    elif piece_type == "B":
+                        rays = rays[4:]
+                    for ray in rays:
+                        for end_row, end_col in ray:
+                            attacked |= 1 << (end_row * 8 + end_col)
+                            end_piece = board[end_row][end_col]
+                            if end_piece != "--" and end_piece != enemy_king:
+                                break
+        return attacked
+
     def getAllPossibleMoves(self):
         """
         All moves without considering checks.
@@ -348,14 +758,14 @@ class GameState:
             king_row, king_col = self.black_king_location
 
         if self.board[row + move_amount][col] == "--":  # 1 square pawn advance
-            if not piece_pinned or pin_direction == (move_amount, 0):
-                moves.append(Move((row, col), (row + move_amount, col), self.board))
+            if not piece_pinned or pin_direction in ((move_amount, 0), (-move_amount, 0)):
+                self.addPawnMove((row, col), (row + move_amount, col), moves)
                 if row == start_row and self.board[row + 2 * move_amount][col] == "--":  # 2 square pawn advance
                     moves.append(Move((row, col), (row + 2 * move_amount, col), self.board))
         if col - 1 >= 0:  # capture to the left
             if not piece_pinned or pin_direction == (move_amount, -1):
                 if self.board[row + move_amount][col - 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col - 1), self.board))
+                    self.addPawnMove((row, col), (row + move_amount, col - 1), moves)
                 if (row + move_amount, col - 1) == self.enpassant_possible:
                     attacking_piece = blocking_piece = False
                     if king_row == row:
@@ -372,16 +782,15 @@ class GameState:
                                 blocking_piece = True
                         for i in outside_range:
                             square = self.board[row][i]
-                            if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
-                                attacking_piece = True
-                            elif square != "--":
-                                blocking_piece = True
+                            if square != "--":  # only the first piece beyond the two pawns can reach the king
+                                attacking_piece = square[0] == enemy_color and (square[1] == "R" or square[1] == "Q")
+                                break
                     if not attacking_piece or blocking_piece:
                         moves.append(Move((row, col), (row + move_amount, col - 1), self.board, is_enpassant_move=True))
         if col + 1 <= 7:  # capture to the right
             if not piece_pinned or pin_direction == (move_amount, +1):
                 if self.board[row + move_amount][col + 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col + 1), self.board))
+                    self.addPawnMove((row, col), (row + move_amount, col + 1), moves)
                 if (row + move_amount, col + 1) == self.enpassant_possible:
                     attacking_piece = blocking_piece = False
                     if king_row == row:
@@ -398,13 +807,22 @@ class GameState:
                                 blocking_piece = True
                         for i in outside_range:
                             square = self.board[row][i]
-                            if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
-                                attacking_piece = True
-                            elif square != "--":
-                                blocking_piece = True
+                            if square != "--":  # only the first piece beyond the two pawns can reach the king
+                                attacking_piece = square[0] == enemy_color and (square[1] == "R" or square[1] == "Q")
+                                break
                     if not attacking_piece or blocking_piece:
                         moves.append(Move((row, col), (row + move_amount, col + 1), self.board, is_enpassant_move=True))
 
+    def addPawnMove(self, start_square, end_square, moves):
+        """
+        Add a pawn move to the list, as one move per promotion piece if the pawn reaches the last rank.
+        """
+        if end_square[0] in (0, 7) and self.underpromotions:
+            for promotion_piece in PROMOTION_PIECES:
+                moves.append(Move(start_square, end_square, self.board, promotion_piece=promotion_piece))
+        else:
+            moves.append(Move(start_square, end_square, self.board))
+
     def getRookMoves(self, row, col, moves):
         """
         Get all the rook moves for the rook located at row, col and add the moves to the list.
@@ -500,57 +918,46 @@ class GameState:
         """
         Get all the queen moves for the queen located at row col and add the moves to the list.
         """
+        self.getRookMoves(row, col, moves)  # rook moves first, the queen's pin is removed by the bishop moves
         self.getBishopMoves(row, col, moves)
-        self.getRookMoves(row, col, moves)
 
     def getKingMoves(self, row, col, moves):
         """
         Get all the king moves for the king located at row col and add the moves to the list.
         """
-        row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
         ally_color = "w" if self.white_to_move else "b"
-        for i in range(8):
-            end_row = row + row_moves[i]
-            end_col = col + col_moves[i]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:  # not an ally piece - empty or enemy
-                    # place king on end square and check for checks
-                    if ally_color == "w":
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = self.checkForPinsAndChecks()
-                    if not in_check:
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
-                    # place king back on original location
-                    if ally_color == "w":
-                        self.white_king_location = (row, col)
-                    else:
-                        self.black_king_location = (row, col)
+        attacked = self.attackedSquares("b" if self.white_to_move else "w")
+        for end_row, end_col in KING_SQUARES[row][col]:
+            # not an ally piece - empty or enemy, and the king may not step onto an attacked square
+            if self.board[end_row][end_col][0] != ally_color and not attacked >> (end_row * 8 + end_col) & 1:
+                moves.append(Move((row, col), (end_row, end_col), self.board))
 
     def getCastleMoves(self, row, col, moves):
         """
         Generate all valid castle moves for the king at (row, col) and add them to the list of moves.
         """
-        if self.squareUnderAttack(row, col):
+        if self.white_to_move:
+            kingside, queenside = self.current_castling_rights.wks, self.current_castling_rights.wqs
+        else:
+            kingside, queenside = self.current_castling_rights.bks, self.current_castling_rights.bqs
+        if not kingside and not queenside:
+            return
+        attacked = self.attackedSquares("b" if self.white_to_move else "w")
+        if attacked >> (row * 8 + col) & 1:
             return  # can't castle while in check
-        if (self.white_to_move and self.current_castling_rights.wks) or (
-                not self.white_to_move and self.current_castling_rights.bks):
-            self.getKingsideCastleMoves(row, col, moves)
-        if (self.white_to_move and self.current_castling_rights.wqs) or (
-                not self.white_to_move and self.current_castling_rights.bqs):
-            self.getQueensideCastleMoves(row, col, moves)
-
-    def getKingsideCastleMoves(self, row, col, moves):
+        if kingside:
+            self.getKingsideCastleMoves(row, col, moves, attacked)
+        if queenside:
+            self.getQueensideCastleMoves(row, col, moves, attacked)
+
+    def getKingsideCastleMoves(self, row, col, moves, attacked):
         if self.board[row][col + 1] == '--' and self.board[row][col + 2] == '--':
-            if not self.squareUnderAttack(row, col + 1) and not self.squareUnderAttack(row, col + 2):
+            if not attacked >> (row * 8 + col + 1) & 1 and not attacked >> (row * 8 + col + 2) & 1:
                 moves.append(Move((row, col), (row, col + 2), self.board, is_castle_move=True))
 
-    def getQueensideCastleMoves(self, row, col, moves):
+    def getQueensideCastleMoves(self, row, col, moves, attacked):
         if self.board[row][col - 1] == '--' and self.board[row][col - 2] == '--' and self.board[row][col - 3] == '--':
-            if not self.squareUnderAttack(row, col - 1) and not self.squareUnderAttack(row, col - 2):
+            if not attacked >> (row * 8 + col - 1) & 1 and not attacked >> (row * 8 + col - 2) & 1:
                 moves.append(Move((row, col), (row, col - 2), self.board, is_castle_move=True))
 
 
@@ -561,8 +968,26 @@ class CastleRights:
         self.wqs = wqs
         self.bqs = bqs
 
+    def index(self):
+        """
+        Pack the four rights into a number between 0 and 15.
+        """
+        return self.wks | self.bks << 1 | self.wqs << 2 | self.bqs << 3
+
+
+PROMOTION_PIECES = ("Q", "R", "B", "N")
+# Move.moveID packs the start square (row * 8 + col) into bits 0-5, the end square into bits 6-11 and the promotion
+# piece into bits 12-13. A queen promotion counts as 0, so it gets the same id as a move built from the clicks.
+PROMOTION_ID_OFFSETS = {"Q": 0, "R": 1 << 12, "B": 2 << 12, "N": 3 << 12}
+
 
 class Move:
+    """
+    __slots__ keeps the many moves created by the search small and quick to build.
+    Notation is only worked out when it is asked for.
+    """
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "piece_moved", "piece_captured", "is_pawn_promotion",
+                 "promotion_piece", "is_enpassant_move", "is_castle_move", "is_capture", "moveID")
     # in chess, fields on the board are described by two symbols, one of them being number between 1-8 (which is corresponding to rows)
     # and the second one being a letter between a-f (corresponding to columns), in order to use this notation we need to map our [row][col] coordinates
     # to match the ones used in the original chess game
@@ -573,7 +998,8 @@ class Move:
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
-    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False):
+    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False,
+                 promotion_piece="Q"):
         self.start_row = start_square[0]
         self.start_col = start_square[1]
         self.end_row = end_square[0]
@@ -583,6 +1009,7 @@ class Move:
         # pawn promotion
         self.is_pawn_promotion = (self.piece_moved == "wp" and self.end_row == 0) or (
                 self.piece_moved == "bp" and self.end_row == 7)
+        self.promotion_piece = promotion_piece
         # en passant
         self.is_enpassant_move = is_enpassant_move
         if self.is_enpassant_move:
@@ -591,7 +1018,9 @@ class Move:
         self.is_castle_move = is_castle_move
 
         self.is_capture = self.piece_captured != "--"
-        self.moveID = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+        self.moveID = self.start_row * 8 + self.start_col | (self.end_row * 8 + self.end_col) << 6
+        if self.is_pawn_promotion:
+            self.moveID |= PROMOTION_ID_OFFSETS[promotion_piece]
 
     def __eq__(self, other):
         """
@@ -603,7 +1032,7 @@ class Move:
 
     def getChessNotation(self):
         if self.is_pawn_promotion:
-            return self.getRankFile(self.end_row, self.end_col) + "Q"
+            return self.getRankFile(self.end_row, self.end_col) + self.promotion_piece
         if self.is_castle_move:
             if self.end_col == 1:
                 return "0-0-0"
@@ -637,11 +1066,42 @@ class Move:
 
         if self.piece_moved[1] == "p":
             if self.is_capture:
-                return self.cols_to_files[self.start_col] + "x" + end_square
+                move_string = self.cols_to_files[self.start_col] + "x" + end_square
+                return move_string + self.promotion_piece if self.is_pawn_promotion else move_string
             else:
-                return end_square + "Q" if self.is_pawn_promotion else end_square
+                return end_square + self.promotion_piece if self.is_pawn_promotion else end_square
 
         move_string = self.piece_moved[1]
         if self.is_capture:
             move_string += "x"
         return move_string + end_square
+
+
+_new_object = object.__new__
+
+
+def newMove(start, end, piece_moved, piece_captured="--", promotion_piece=None, is_enpassant_move=False,
+            is_castle_move=False):
+    """
+    Build a Move from its start and end square (row * 8 + col) and the pieces the move generator already knows,
+    without reading the board. promotion_piece is only given for promotions.
+    """
+    move = _new_object(Move)
+    move.start_row = start >> 3
+    move.start_col = start & 7
+    move.end_row = end >> 3
+    move.end_col = end & 7
+    move.piece_moved = piece_moved
+    move.piece_captured = piece_captured
+    move.is_capture = piece_captured != "--"
+    move.is_enpassant_move = is_enpassant_move
+    move.is_castle_move = is_castle_move
+    if promotion_piece is None:
+        move.is_pawn_promotion = False
+        move.promotion_piece = "Q"
+        move.moveID = start | end << 6
+    else:
+        move.is_pawn_promotion = True
+        move.promotion_piece = promotion_piece
+        move.moveID = start | end << 6 | PROMOTION_ID_OFFSETS[promotion_piece]
+    return move
@@ -0,0 +1,153 @@
+"""
+Evaluation tables - material values, middlegame and endgame piece-square tables and game phase weights.
+GameState keeps its running scores with the lookups built from them and ChessAI scores positions with them,
+so this module imports neither.
+"""
+piece_score = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
+piece_phase = {"K": 0, "Q": 4, "R": 2, "B": 1, "N": 1, "p": 0}  # weight of the piece in the game phase
+MAX_PHASE = 24  # phase of the starting position, the middlegame tables count fully from there, the endgame ones at 0
+
+knight_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
+                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
+                 [0.2, 0.5, 0.6, 0.65, 0.65, 0.6, 0.5, 0.2],
+                 [0.2, 0.55, 0.65, 0.7, 0.7, 0.65, 0.55, 0.2],
+                 [0.2, 0.5, 0.65, 0.7, 0.7, 0.65, 0.5, 0.2],
+                 [0.2, 0.55, 0.6, 0.65, 0.65, 0.6, 0.55, 0.2],
+                 [0.1, 0.3, 0.5, 0.55, 0.55, 0.5, 0.3, 0.1],
+                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
+
+bishop_scores = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
+                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
+                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
+                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
+                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
+                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
+                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
+                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
+
+rook_scores = [[0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
+               [0.5, 0.75, 0.75, 0.75, 0.75, 0.75, 0.75, 0.5],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.25, 0.25, 0.25, 0.5, 0.5, 0.25, 0.25, 0.25]]
+
+queen_scores = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
+                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
+                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
+                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
+                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
+                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
+                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
+                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
+
+pawn_scores = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
+               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
+               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
+               [0.25, 0.25, 0.3, 0.45, 0.45, 0.3, 0.25, 0.25],
+               [0.2, 0.2, 0.2, 0.4, 0.4, 0.2, 0.2, 0.2],
+               [0.25, 0.15, 0.1, 0.2, 0.2, 0.1, 0.15, 0.25],
+               [0.25, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.25],
+               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
+
+king_scores = [[0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+               [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+               [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+               [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+               [0.05, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.05],
+               [0.1, 0.05, 0.05, 0.0, 0.0, 0.05, 0.05, 0.1],
+               [0.3, 0.3, 0.15, 0.1, 0.1, 0.15, 0.3, 0.3],
+               [0.4, 0.5, 0.35, 0.15, 0.15, 0.2, 0.5, 0.4]]
+
+# endgame tables: the king and the queen belong in the centre, pawns are worth more the closer they are to promotion
+# and the rook's seventh rank matters less; the knight and bishop tables are the same as in the middlegame
+king_endgame_scores = [[0.0, 0.1, 0.2, 0.3, 0.3, 0.2, 0.1, 0.0],
+                       [0.1, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.1],
+                       [0.2, 0.4, 0.6, 0.7, 0.7, 0.6, 0.4, 0.2],
+                       [0.3, 0.5, 0.7, 0.8, 0.8, 0.7, 0.5, 0.3],
+                       [0.3, 0.5, 0.7, 0.8, 0.8, 0.7, 0.5, 0.3],
+                       [0.2, 0.4, 0.6, 0.7, 0.7, 0.6, 0.4, 0.2],
+                       [0.1, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.1],
+                       [0.0, 0.1, 0.2, 0.3, 0.3, 0.2, 0.1, 0.0]]
+
+queen_endgame_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
+                        [0.1, 0.3, 0.3, 0.4, 0.4, 0.3, 0.3, 0.1],
+                        [0.2, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.2],
+                        [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
+                        [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
+                        [0.2, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.2],
+                        [0.1, 0.3, 0.3, 0.4, 0.4, 0.3, 0.3, 0.1],
+                        [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
+
+rook_endgame_scores = [[0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
+                       [0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4],
+                       [0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
+                       [0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
+                       [0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
+                       [0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
+                       [0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
+                       [0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25]]
+
+pawn_endgame_scores = [[1.2, 1.2, 1.2, 1.2, 1.2, 1.2, 1.2, 1.2],
+                       [1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0],
+                       [0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6],
+                       [0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4],
+                       [0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
+                       [0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.1],
+                       [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+                       [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]]
+
+piece_position_scores = {"wN": knight_scores,
+                         "bN": knight_scores[::-1],
+                         "wB": bishop_scores,
+                         "bB": bishop_scores[::-1],
+                         "wQ": queen_scores,
+                         "bQ": queen_scores[::-1],
+                         "wR": rook_scores,
+                         "bR": rook_scores[::-1],
+                         "wp": pawn_scores,
+                         "bp": pawn_scores[::-1],
+                         "wK": king_scores,
+                         "bK": king_scores[::-1]}
+
+endgame_position_scores = {"wN": knight_scores,
+                           "bN": knight_scores[::-1],
+                           "wB": bishop_scores,
+                           "bB": bishop_scores[::-1],
+                           "wQ": queen_endgame_scores,
+                           "bQ": queen_endgame_scores[::-1],
+                           "wR": rook_endgame_scores,
+                           "bR": rook_endgame_scores[::-1],
+                           "wp": pawn_endgame_scores,
+                           "bp": pawn_endgame_scores[::-1],
+                           "wK": king_endgame_scores,
+                           "bK": king_endgame_scores[::-1]}
+
+
+def buildPieceSquareValues():
+    """
+    Turn piece_score, piece_position_scores and endgame_position_scores into signed per-square lookups, positive
+    for white pieces and negative for black ones, and piece_phase into phase_values. GameState keeps its running
+    material, position and phase totals with them, so call this again after changing any of the tables.
+    """
+    global material_values, position_values, endgame_position_values, phase_values
+    material_values = {}
+    position_values = {}
+    endgame_position_values = {}
+    phase_values = {}
+    for piece in ("wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK"):
+        sign = 1 if piece[0] == "w" else -1
+        material_values[piece] = sign * piece_score[piece[1]]
+        table = piece_position_scores[piece]
+        position_values[piece] = [sign * table[square // 8][square % 8] for square in range(64)]
+        table = endgame_position_scores[piece]
+        endgame_position_values[piece] = [sign * table[square // 8][square % 8] for square in range(64)]
+        phase_values[piece] = piece_phase[piece[1]]
+
+
+buildPieceSquareValues()
+
+# victim and attacker values of the MVV-LVA capture ordering (most valuable victim, least valuable attacker)
+mvv_lva_value = {"p": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 10}
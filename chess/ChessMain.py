@@ -4,9 +4,9 @@ Handling user input.
 Displaying current GameStatus object.
 """
 import pygame as p
-import ChessEngine, ChessAI
+import ChessEngine, ChessAI, ChessBitboard, ChessWorker
+import os
 import sys
-from multiprocessing import Process, Queue
 
 BOARD_WIDTH = BOARD_HEIGHT = 512
 MOVE_LOG_PANEL_WIDTH = 250
@@ -15,6 +15,18 @@ DIMENSION = 8
 SQUARE_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 15
 IMAGES = {}
+BOARD_COLORS = ("white", "gray")  # light and dark squares, the top left square is light
+HIGHLIGHT_COLORS = ("green", "blue", "yellow")  # last move, selected square, moves of the selected piece
+HIGHLIGHTS = {}  # color -> the translucent square surface blitted to highlight a square with it
+board_surface = None  # the empty board, drawn once by loadImages
+MOVES_PER_LINE = 3  # full moves (white and black) on a line of the move log
+MOVE_LOG_PADDING = 5
+MOVE_LOG_LINE_SPACING = 2
+USE_BITBOARDS = True  # if True, the faster bitboard engine core generates the moves
+AI_MOVE_TIME = 2000  # milliseconds the engine may think about a move
+AI_MAX_DEPTH = 10
+AI_WORKERS = min(os.cpu_count() or 1, 8)  # processes the engine searches with, 1 runs the single-process search
+PONDER = True  # if True, the engine searches the expected reply while the human thinks
 
 
 def loadImages():
@@ -22,9 +34,23 @@ def loadImages():
     Initialize a global directory of images.
     This will be called exactly once in the main.
     """
+    global board_surface
     pieces = ['wp', 'wR', 'wN', 'wB', 'wK', 'wQ', 'bp', 'bR', 'bN', 'bB', 'bK', 'bQ']
     for piece in pieces:
         IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQUARE_SIZE, SQUARE_SIZE))
+        IMAGES[piece] = IMAGES[piece].convert_alpha()  # in the display's pixel format, blits are much quicker
+    for color in HIGHLIGHT_COLORS:
+        HIGHLIGHTS[color] = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
+        HIGHLIGHTS[color].set_alpha(100)  # transparency value 0 -> transparent, 255 -> opaque
+        HIGHLIGHTS[color].fill(p.Color(color))
+    board_surface = drawBoard()
+
+
+def newGameState():
+    """
+    Create the starting position with the engine core selected by USE_BITBOARDS.
+    """
+    return ChessBitboard.ENGINES["bitboard" if USE_BITBOARDS else "mailbox"]()
 
 
 def main():
@@ -36,7 +62,7 @@ def main():
     screen = p.display.set_mode((BOARD_WIDTH + MOVE_LOG_PANEL_WIDTH, BOARD_HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    game_state = ChessEngine.GameState()
+    game_state = newGameState()
     valid_moves = game_state.getValidMoves()
     move_made = False  # flag variable for when a move is made
     animate = False  # flag variable for when we should animate a move
@@ -47,20 +73,36 @@ def main():
     game_over = False
     ai_thinking = False
     move_undone = False
-    move_finder_process = None
+    engine = ChessWorker.EngineWorker(USE_BITBOARDS)  # stays alive for the whole game, see ChessWorker
     move_log_font = p.font.SysFont("Arial", 14, False, False)
     player_one = True  # if a human is playing white, then this will be True, else False
     player_two = False  # if a hyman is playing white, then this will be True, else False
+    drawn_squares = {}  # what every square shows on the screen, see drawGameState
+    move_log_panel = MoveLogPanel(move_log_font, p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT))
+    # mouse motion and the like would only wake the loop up for nothing
+    p.event.set_blocked(None)
+    p.event.set_allowed([p.QUIT, p.MOUSEBUTTONDOWN, p.MOUSEWHEEL, p.KEYDOWN, p.VIDEOEXPOSE])
 
     while running:
         human_turn = (game_state.white_to_move and player_one) or (not game_state.white_to_move and player_two)
-        for e in p.event.get():
-            if e.type == p.QUIT:
+        if (human_turn or game_over) and not move_log_panel.dirty:  # drawn, nothing changes until the user acts
+            events = [p.event.wait()] + p.event.get()
+        else:
+            clock.tick(MAX_FPS)  # the engine is thinking, check for its move now and then
+            events = p.event.get()
+        for e in events:
+            if e.type == p.VIDEOEXPOSE:  # the window was covered, everything has to be drawn again
+                drawn_squares.clear()
+                move_log_panel.dirty = True
+            elif e.type == p.MOUSEWHEEL:  # scroll the move log
+                move_log_panel.scroll(e.y)
+            elif e.type == p.QUIT:
+                engine.quit()
                 p.quit()
                 sys.exit()
             # mouse handler
             elif e.type == p.MOUSEBUTTONDOWN:
-                if not game_over:
+                if not game_over and e.button in (p.BUTTON_LEFT, p.BUTTON_MIDDLE, p.BUTTON_RIGHT):  # not the wheel
                     location = p.mouse.get_pos()  # (x, y) location of the mouse
                     col = location[0] // SQUARE_SIZE
                     row = location[1] // SQUARE_SIZE
@@ -74,7 +116,14 @@ def main():
                         move = ChessEngine.Move(player_clicks[0], player_clicks[1], game_state.board)
                         for i in range(len(valid_moves)):
                             if move == valid_moves[i]:
+                                if engine.pondering:
+                                    if valid_moves[i] == engine.ponder_move:  # ponder hit, keep searching
+                                        engine.ponderHit(AI_MOVE_TIME)
+                                        ai_thinking = True
+                                    else:
+                                        engine.stop()
                                 game_state.makeMove(valid_moves[i])
+                                engine.makeMove(valid_moves[i])
                                 move_made = True
                                 animate = True
                                 square_selected = ()  # reset user clicks
@@ -86,162 +135,213 @@ def main():
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:  # undo when 'z' is pressed
                     game_state.undoMove()
+                    engine.undoMove()  # also stops the search if the engine is thinking
                     move_made = True
                     animate = False
                     game_over = False
-                    if ai_thinking:
-                        move_finder_process.terminate()
-                        ai_thinking = False
+                    ai_thinking = False
                     move_undone = True
+                    drawn_squares.clear()  # the end of game text may be on the board
                 if e.key == p.K_r:  # reset the game when 'r' is pressed
-                    game_state = ChessEngine.GameState()
+                    game_state = newGameState()
                     valid_moves = game_state.getValidMoves()
                     square_selected = ()
                     player_clicks = []
                     move_made = False
                     animate = False
                     game_over = False
-                    if ai_thinking:
-                        move_finder_process.terminate()
-                        ai_thinking = False
+                    engine.newGame()
+                    ai_thinking = False
                     move_undone = True
+                    drawn_squares.clear()
 
         # AI move finder
         if not game_over and not human_turn and not move_undone:
             if not ai_thinking:
                 ai_thinking = True
-                return_queue = Queue()  # used to pass data between threads
-                move_finder_process = Process(target=ChessAI.findBestMove, args=(game_state, valid_moves, return_queue))
-                move_finder_process.start()
+                engine.go(game_state.zobrist_key, movetime=AI_MOVE_TIME, max_depth=AI_MAX_DEPTH, workers=AI_WORKERS)
 
-            if not move_finder_process.is_alive():
-                ai_move = return_queue.get()
+            if engine.poll():
+                ai_move = engine.best_move
                 if ai_move is None:
                     ai_move = ChessAI.findRandomMove(valid_moves)
                 game_state.makeMove(ai_move)
+                engine.makeMove(ai_move)
                 move_made = True
                 animate = True
                 ai_thinking = False
+                if PONDER and (player_one or player_two) and engine.ponder_move is not None:  # a human is next
+                    engine.ponder(game_state.zobrist_key, engine.ponder_move, max_depth=AI_MAX_DEPTH,
+                                  workers=AI_WORKERS)
 
         if move_made:
             if animate:
-                animateMove(game_state.move_log[-1], screen, game_state.board, clock)
+                animateMove(game_state.move_log[-1], screen, game_state, clock)
+                drawn_squares.clear()
             valid_moves = game_state.getValidMoves()
             move_made = False
             animate = False
             move_undone = False
 
-        drawGameState(screen, game_state, valid_moves, square_selected)
+        board_redrawn = not drawn_squares  # the whole board is drawn again, over the end of game text if it was shown
+        dirty_rects = drawGameState(screen, game_state, valid_moves, square_selected, drawn_squares)
 
-        if not game_over:
-            drawMoveLog(screen, game_state, move_log_font)
+        move_log_panel.update(game_state.move_log)
+        if move_log_panel.dirty:
+            dirty_rects.append(move_log_panel.draw(screen))
 
-        if game_state.checkmate:
+        if (game_state.checkmate or game_state.stalemate) and not game_over:
             game_over = True
-            if game_state.white_to_move:
-                drawEndGameText(screen, "Black wins by checkmate")
+            board_redrawn = True
+        if game_over and board_redrawn:  # first shown, or drawn over by an expose, undo or reset
+            if game_state.stalemate:
+                dirty_rects.append(drawEndGameText(screen, "Stalemate"))
+            elif game_state.white_to_move:
+                dirty_rects.append(drawEndGameText(screen, "Black wins by checkmate"))
             else:
-                drawEndGameText(screen, "White wins by checkmate")
+                dirty_rects.append(drawEndGameText(screen, "White wins by checkmate"))
 
-        elif game_state.stalemate:
-            game_over = True
-            drawEndGameText(screen, "Stalemate")
+        if dirty_rects:
+            p.display.update(dirty_rects)
 
-        clock.tick(MAX_FPS)
-        p.display.flip()
 
-
-def drawGameState(screen, game_state, valid_moves, square_selected):
+def drawGameState(screen, game_state, valid_moves, square_selected, drawn_squares):
     """
     Responsible for all the graphics within current game state.
+    Only the squares that look different from drawn_squares ({(row, col): (piece, highlights)} of what is on the
+    screen, updated here) are drawn again, clear it to redraw the whole board. Returns the rects drawn.
     """
-    drawBoard(screen)  # draw squares on the board
-    highlightSquares(screen, game_state, valid_moves, square_selected)
-    drawPieces(screen, game_state.board)  # draw pieces on top of those squares
+    highlights = squareHighlights(game_state, valid_moves, square_selected)
+    dirty_rects = []
+    for row in range(DIMENSION):
+        for column in range(DIMENSION):
+            square = (game_state.board[row][column], highlights.get((row, column), ()))
+            if drawn_squares.get((row, column)) != square:
+                drawn_squares[(row, column)] = square
+                dirty_rects.append(drawSquare(screen, row, column, *square))
+    return dirty_rects
 
 
-def drawBoard(screen):
+def drawBoard():
     """
-    Draw the squares on the board.
+    Draw the squares on a surface of their own, the board is blitted from it instead of drawing every square.
     The top left square is always light.
     """
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
+    surface = p.Surface((BOARD_WIDTH, BOARD_HEIGHT)).convert()
+    colors = [p.Color(color) for color in BOARD_COLORS]
     for row in range(DIMENSION):
         for column in range(DIMENSION):
             color = colors[((row + column) % 2)]
-            p.draw.rect(screen, color, p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+            p.draw.rect(surface, color, p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+    return surface
 
 
-def highlightSquares(screen, game_state, valid_moves, square_selected):
+def squareHighlights(game_state, valid_moves, square_selected):
     """
-    Highlight square selected and moves for piece selected.
+    {(row, col): highlight colors in drawing order} for the last move, the square selected and the moves
+    of the piece selected.
     """
+    highlights = {}
     if (len(game_state.move_log)) > 0:
         last_move = game_state.move_log[-1]
-        s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-        s.set_alpha(100)
-        s.fill(p.Color('green'))
-        screen.blit(s, (last_move.end_col * SQUARE_SIZE, last_move.end_row * SQUARE_SIZE))
+        highlights[(last_move.end_row, last_move.end_col)] = ("green",)
     if square_selected != ():
         row, col = square_selected
         if game_state.board[row][col][0] == (
                 'w' if game_state.white_to_move else 'b'):  # square_selected is a piece that can be moved
-            # highlight selected square
-            s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-            s.set_alpha(100)  # transparency value 0 -> transparent, 255 -> opaque
-            s.fill(p.Color('blue'))
-            screen.blit(s, (col * SQUARE_SIZE, row * SQUARE_SIZE))
-            # highlight moves from that square
-            s.fill(p.Color('yellow'))
+            highlights[square_selected] = highlights.get(square_selected, ()) + ("blue",)
             for move in valid_moves:
                 if move.start_row == row and move.start_col == col:
-                    screen.blit(s, (move.end_col * SQUARE_SIZE, move.end_row * SQUARE_SIZE))
+                    end_square = (move.end_row, move.end_col)
+                    if "yellow" not in highlights.get(end_square, ()):  # once for all the promotion pieces
+                        highlights[end_square] = highlights.get(end_square, ()) + ("yellow",)
+    return highlights
 
 
-def drawPieces(screen, board):
+def drawSquare(screen, row, column, piece, highlights=()):
     """
-    Draw the pieces on the board using the current game_state.board
+    Draw one square from the cached board with its highlights and piece, returns its rect.
     """
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            piece = board[row][column]
-            if piece != "--":
-                screen.blit(IMAGES[piece], p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+    square_rect = p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+    screen.blit(board_surface, square_rect, square_rect)
+    for color in highlights:
+        screen.blit(HIGHLIGHTS[color], square_rect)
+    if piece != "--":
+        screen.blit(IMAGES[piece], square_rect)
+    return square_rect
 
 
-def drawMoveLog(screen, game_state, font):
+class MoveLogPanel:
     """
-    Draws the move log.
-
+    The move log next to the board. Every line of text is rendered once and kept: a move renders only the last
+    line again and an undo drops the lines after the move taken back, so drawing the panel costs the same however
+    long the game is. When the lines don't fit anymore the oldest scroll out, the mouse wheel brings them back.
     """
-    move_log_rect = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
-    p.draw.rect(screen, p.Color('black'), move_log_rect)
-    move_log = game_state.move_log
-    move_texts = []
-    for i in range(0, len(move_log), 2):
-        move_string = str(i // 2 + 1) + '. ' + str(move_log[i]) + " "
-        if i + 1 < len(move_log):
-            move_string += str(move_log[i + 1]) + "  "
-        move_texts.append(move_string)
-
-    moves_per_row = 3
-    padding = 5
-    line_spacing = 2
-    text_y = padding
-    for i in range(0, len(move_texts), moves_per_row):
-        text = ""
-        for j in range(moves_per_row):
-            if i + j < len(move_texts):
-                text += move_texts[i + j]
 
-        text_object = font.render(text, True, p.Color('white'))
-        text_location = move_log_rect.move(padding, text_y)
-        screen.blit(text_object, text_location)
-        text_y += text_object.get_height() + line_spacing
+    def __init__(self, font, rect):
+        self.font = font
+        self.rect = rect
+        self.moves = []  # the moves of the log that lines were rendered for
+        self.lines = []  # rendered text surfaces, MOVES_PER_LINE full moves each
+        self.line_height = font.get_linesize() + MOVE_LOG_LINE_SPACING
+        self.visible_lines = max(1, (rect.height - MOVE_LOG_PADDING) // self.line_height)
+        self.scrolled_lines = 0  # lines scrolled back from the end of the log
+        self.dirty = True  # True if the panel has to be drawn again
+
+    def update(self, move_log):
+        """
+        Catch up with the moves made and taken back since the last update.
+        """
+        moves = self.moves
+        rendered_moves = len(moves)
+        while moves and (len(moves) > len(move_log) or moves[-1] is not move_log[len(moves) - 1]):
+            moves.pop()  # taken back
+        first_changed = len(moves)
+        if first_changed == rendered_moves == len(move_log):
+            return
+        moves.extend(move_log[len(moves):])
+        first_line = first_changed // (2 * MOVES_PER_LINE)
+        del self.lines[first_line:]
+        for line in range(first_line, (len(moves) + 2 * MOVES_PER_LINE - 1) // (2 * MOVES_PER_LINE)):
+            self.lines.append(self.font.render(self.lineText(line), True, p.Color('white')))
+        self.scrolled_lines = 0  # show the last move
+        self.dirty = True
+
+    def lineText(self, line):
+        text = ""
+        for ply in range(line * 2 * MOVES_PER_LINE, min((line + 1) * 2 * MOVES_PER_LINE, len(self.moves)), 2):
+            text += str(ply // 2 + 1) + '. ' + str(self.moves[ply]) + " "
+            if ply + 1 < len(self.moves):
+                text += str(self.moves[ply + 1]) + "  "
+        return text
+
+    def scroll(self, lines):
+        """
+        Scroll back (lines > 0) or forward in the log.
+        """
+        scrolled_lines = min(max(0, self.scrolled_lines + lines), max(0, len(self.lines) - self.visible_lines))
+        if scrolled_lines != self.scrolled_lines:
+            self.scrolled_lines = scrolled_lines
+            self.dirty = True
+
+    def draw(self, screen):
+        """
+        Draw the visible lines, returns the rect of the panel.
+        """
+        p.draw.rect(screen, p.Color('black'), self.rect)
+        first_line = max(0, len(self.lines) - self.visible_lines - self.scrolled_lines)
+        text_location = self.rect.move(MOVE_LOG_PADDING, MOVE_LOG_PADDING)
+        for text_object in self.lines[first_line:first_line + self.visible_lines]:
+            screen.blit(text_object, text_location)
+            text_location = text_location.move(0, self.line_height)
+        self.dirty = False
+        return self.rect
 
 
 def drawEndGameText(screen, text):
+    """
+    Draw the text over the middle of the board, returns the rect it covers.
+    """
     font = p.font.SysFont("Helvetica", 32, True, False)
     text_object = font.render(text, False, p.Color("gray"))
     text_location = p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT).move(BOARD_WIDTH / 2 - text_object.get_width() / 2,
@@ -249,34 +349,45 @@ def drawEndGameText(screen, text):
     screen.blit(text_object, text_location)
     text_object = font.render(text, False, p.Color('black'))
     screen.blit(text_object, text_location.move(2, 2))
+    return p.Rect(text_location.topleft, (text_object.get_width() + 2, text_object.get_height() + 2))
 
 
-def animateMove(move, screen, board, clock):
+def animateMove(move, screen, game_state, clock):
     """
-    Animating a move
+    Animating a move. The board is drawn once as it is after the move, without the piece moved, and kept as the
+    background; every frame only restores the background under the piece's last position and draws it again.
+    The board is left without highlights, so redraw all of it afterwards.
     """
-    global colors
     d_row = move.end_row - move.start_row
     d_col = move.end_col - move.start_col
     frames_per_square = 10  # frames to move one square
     frame_count = (abs(d_row) + abs(d_col)) * frames_per_square
+    board = game_state.board
+    for row in range(DIMENSION):
+        for column in range(DIMENSION):
+            drawSquare(screen, row, column, board[row][column])
+    # erase the piece moved from its ending square, draw the captured piece there until the piece arrives
+    drawSquare(screen, move.end_row, move.end_col, "--")
+    if move.piece_captured != '--':
+        captured_row = move.end_row
+        if move.is_enpassant_move:
+            captured_row = move.end_row + 1 if move.piece_captured[0] == 'b' else move.end_row - 1
+        drawSquare(screen, captured_row, move.end_col, move.piece_captured)
+    board_rect = p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT)
+    background = screen.subsurface(board_rect).copy()
+    p.display.update(board_rect)
+    piece_rect = None
     for frame in range(frame_count + 1):
         row, col = (move.start_row + d_row * frame / frame_count, move.start_col + d_col * frame / frame_count)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # erase the piece moved from its ending square
-        color = colors[(move.end_row + move.end_col) % 2]
-        end_square = p.Rect(move.end_col * SQUARE_SIZE, move.end_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-        p.draw.rect(screen, color, end_square)
-        # draw captured piece onto rectangle
-        if move.piece_captured != '--':
-            if move.is_enpassant_move:
-                enpassant_row = move.end_row + 1 if move.piece_captured[0] == 'b' else move.end_row - 1
-                end_square = p.Rect(move.end_col * SQUARE_SIZE, enpassant_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-            screen.blit(IMAGES[move.piece_captured], end_square)
+        dirty_rects = []
+        if piece_rect is not None:
+            screen.blit(background, piece_rect, piece_rect)
+            dirty_rects.append(piece_rect)
         # draw moving piece
-        screen.blit(IMAGES[move.piece_moved], p.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-        p.display.flip()
+        piece_rect = p.Rect(round(col * SQUARE_SIZE), round(row * SQUARE_SIZE), SQUARE_SIZE, SQUARE_SIZE)
+        screen.blit(IMAGES[move.piece_moved], piece_rect)
+        dirty_rects.append(piece_rect)
+        p.display.update(dirty_rects)
         clock.tick(60)
 
 
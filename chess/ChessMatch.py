@@ -0,0 +1,316 @@
+"""
+Self-play match - two engine configurations play each other without pygame, on every core, to check that a change
+makes the engine stronger and not only faster.
+
+A configuration is a list of NAME=value settings: depth, movetime (milliseconds) and nodes limit the search of
+every move, any other name is a ChessAI or ChessEvaluation setting changed for that engine's moves only, e.g.
+    "depth=4"   "depth=3 NULL_MOVE_PRUNING=False"   "movetime=200 piece_score={'K':0,'Q':9,'R':5,'B':3.25,'N':3,'p':1}"
+Every opening is played twice, the engines swapping colours. Finished games are printed and appended to the PGN file
+as they come, the match ends with the score, the Elo difference with its 95% error margin and the speed of both.
+
+Run it from this directory, e.g.:
+    python ChessMatch.py --first "depth=4" --second "depth=3" --games 40 --pgn match.pgn
+    python ChessMatch.py --first "movetime=300" --second "movetime=300 LATE_MOVE_REDUCTIONS=False" --workers 8
+"""
+import argparse
+import ast
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import ChessAI
+import ChessAnalysis
+import ChessBitboard
+import ChessBook
+import ChessEngine
+import ChessEvaluation
+
+SEARCH_LIMITS = {"depth": "max_depth", "movetime": "movetime", "nodes": "max_nodes"}
+MAX_PLIES = 400  # a game still going after this many plies is a draw
+# played from both sides, the openings are short so that the engines decide the middlegame themselves
+OPENINGS = ("e4 e5 Nf3 Nc6 Bb5", "e4 e5 Nf3 Nc6 Bc4", "e4 c5 Nf3 d6", "e4 c5 Nc3 Nc6", "e4 e6 d4 d5",
+            "e4 c6 d4 d5", "e4 d5 exd5 Qxd5", "e4 Nf6 e5 Nd5", "d4 d5 c4 e6", "d4 d5 c4 c6", "d4 Nf6 c4 g6",
+            "d4 Nf6 c4 e6 Nc3 Bb4", "d4 f5 g3 Nf6", "c4 e5 Nc3 Nf6", "Nf3 d5 g3 Nf6", "c4 c5 Nf3 Nc6")
+
+
+def parseConfiguration(text):
+    """
+    {name: value} of a configuration string, see the module docstring. Raises ValueError for unknown names.
+    """
+    configuration = {}
+    for setting in splitSettings(text):
+        name, _, value = setting.partition("=")
+        if name not in SEARCH_LIMITS and settingModule(name) is None:
+            raise ValueError("unknown setting %s" % name)
+        try:
+            configuration[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            raise ValueError("bad value in %s" % setting)
+    return configuration
+
+
+def settingModule(name):
+    """
+    The module holding the setting: ChessEvaluation for the evaluation tables, ChessAI for the rest, None if unknown.
+    """
+    for module in (ChessEvaluation, ChessAI):
+        if hasattr(module, name):
+            return module
+    return None
+
+
+def splitSettings(text):
+    """
+    Split at the spaces outside of brackets, so that tables can be given as dict or list literals.
+    """
+    settings, current, level = [], "", 0
+    for char in text:
+        if char in "{[(":
+            level += 1
+        elif char in "}])":
+            level -= 1
+        if char == " " and level == 0:
+            if current:
+                settings.append(current)
+            current = ""
+        else:
+            current += char
+    return settings + [current] if current else settings
+
+
+class Player:
+    """
+    One engine configuration in a game, with its own transposition table, pawn hash table and history. ChessAI is
+    shared by both players of a game, so its settings and tables are swapped in for every move and restored afterwards.
+    """
+
+    def __init__(self, name, configuration):
+        self.name = name
+        self.settings = {name: value for name, value in configuration.items() if name not in SEARCH_LIMITS}
+        self.limits = {SEARCH_LIMITS[name]: value for name, value in configuration.items() if name in SEARCH_LIMITS}
+        self.transposition_table = ChessAI.TranspositionTable(self.settings.get("TT_SIZE", ChessAI.TT_SIZE))
+        self.pawn_table = ChessAI.PawnHashTable(self.settings.get("PAWN_HASH_SIZE", ChessAI.PAWN_HASH_SIZE))
+        self.history_scores = {}
+        self.nodes = 0
+        self.seconds = 0.0
+
+    def findMove(self, game_state, valid_moves):
+        saved = {name: getattr(settingModule(name), name) for name in self.settings}
+        for name, value in self.settings.items():
+            setattr(settingModule(name), name, value)
+        ChessAI.transposition_table = self.transposition_table
+        ChessAI.pawn_table = self.pawn_table
+        ChessAI.history_scores = self.history_scores
+        try:
+            # the evaluation tables may differ between the players, the running scores must follow them
+            ChessEvaluation.buildPieceSquareValues()
+            rescore(game_state)
+            search_limits = {"max_depth": ChessAI.DEPTH}
+            search_limits.update(self.limits)
+            start_time = time.perf_counter()
+            # the openings are given, the engines play from there without the book
+            move, stats = ChessAI.findBestMove(game_state, list(valid_moves), None, use_book=False, **search_limits)
+            self.seconds += time.perf_counter() - start_time
+            self.nodes += stats.nodes + stats.quiescence_nodes
+        finally:
+            for name, value in saved.items():
+                setattr(settingModule(name), name, value)
+            ChessEvaluation.buildPieceSquareValues()
+            rescore(game_state)
+        return move if move is not None else valid_moves[0]
+
+
+def rescore(game_state):
+    scores = game_state.computeScores()
+    game_state.material_score, game_state.position_score, game_state.endgame_position_score, game_state.phase = scores
+    game_state.score_log[-1] = scores
+
+
+def gameResult(game_state, valid_moves, plies):
+    """
+    (result, termination) if the game is over, else (None, None).
+    """
+    if not valid_moves:
+        if game_state.inCheck():
+            return ("0-1" if game_state.white_to_move else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+    if game_state.halfmove_clock >= 100:
+        return "1/2-1/2", "50-move rule"
+    # a repetition can only go back to the last capture or pawn move
+    if game_state.zobrist_key_log[-game_state.halfmove_clock - 1:].count(game_state.zobrist_key) >= 3:
+        return "1/2-1/2", "threefold repetition"
+    if game_state.piece_count == 2 or (game_state.piece_count == 3 and
+                                       any(piece[1] in "BN" for row in game_state.board for piece in row)):
+        return "1/2-1/2", "insufficient material"
+    if plies >= MAX_PLIES:
+        return "1/2-1/2", "move limit"
+    return None, None
+
+
+def playGame(number, opening, white, black, engine):
+    """
+    Play one game from the opening, (fen, SAN moves) with the opening moves first. white and black are
+    (name, configuration). Returns the game as a dict, with the nodes and seconds used by each side.
+    """
+    fen, opening_moves = opening
+    game_state = ChessBitboard.ENGINES[engine](fen)
+    start_fen = game_state.getFen()
+    players = {True: Player(*white), False: Player(*black)}
+    moves = []
+    for san in opening_moves:
+        move = ChessBook.parseSan(san, game_state.getValidMoves())
+        if move is None:
+            raise ValueError("opening %s: can't play %s" % (" ".join(opening_moves), san))
+        moves.append(san)
+        game_state.makeMove(move)
+    while True:
+        valid_moves = game_state.getValidMoves()
+        result, termination = gameResult(game_state, valid_moves, len(moves))
+        if result is not None:
+            break
+        move = players[game_state.white_to_move].findMove(game_state, valid_moves)
+        san = ChessBook.moveToSan(move, valid_moves)
+        game_state.makeMove(move)
+        if game_state.inCheck():
+            san += "#" if not game_state.getValidMoves() else "+"
+        moves.append(san)
+    return {"round": number, "white": white[0], "black": black[0], "fen": start_fen, "moves": moves,
+            "result": result, "termination": termination,
+            "nodes": {player.name: player.nodes for player in players.values()},
+            "seconds": {player.name: player.seconds for player in players.values()}}
+
+
+def writePgn(file, game, start_fen):
+    """
+    Append the game to the PGN file.
+    """
+    tags = [("Event", "Self-play match"), ("Site", "?"), ("Date", time.strftime("%Y.%m.%d")),
+            ("Round", str(game["round"])), ("White", game["white"]), ("Black", game["black"]),
+            ("Result", game["result"])]
+    if game["fen"] != start_fen:
+        tags += [("SetUp", "1"), ("FEN", game["fen"])]
+    tags += [("PlyCount", str(len(game["moves"]))), ("Termination", game["termination"])]
+    for name, value in tags:
+        file.write('[%s "%s"]\n' % (name, value.replace('"', "'")))
+    fields = game["fen"].split()
+    white_to_move, move_number = fields[1] == "w", int(fields[5])
+    tokens = [] if white_to_move else ["%d..." % move_number]
+    for san in game["moves"]:
+        if white_to_move:
+            tokens.append("%d." % move_number)
+        else:
+            move_number += 1
+        tokens.append(san)
+        white_to_move = not white_to_move
+    tokens.append(game["result"])
+    line = ""
+    for token in tokens:  # PGN lines are kept under 80 characters
+        if line and len(line) + len(token) >= 80:
+            file.write(line + "\n")
+            line = ""
+        line = line + " " + token if line else token
+    file.write(line + "\n\n")
+    file.flush()
+
+
+def eloDifference(wins, draws, losses):
+    """
+    (Elo difference, its 95% error margin) of a score of wins, draws and losses.
+    The margin is infinite while the score is still 0% or 100%.
+    """
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, math.inf
+    score = (wins + draws / 2) / games
+    deviation = math.sqrt((wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games)
+
+    def elo(points):
+        if points <= 0 or points >= 1:
+            return math.copysign(math.inf, points - 0.5)
+        return 400 * math.log10(points / (1 - points))
+
+    if score in (0, 1):
+        return elo(score), math.inf  # the difference itself is infinite, elo(1) - elo(1) would be nan
+    margin = 1.96 * deviation / math.sqrt(games)
+    return elo(score), (elo(score + margin) - elo(score - margin)) / 2
+
+
+def readOpenings(path):
+    """
+    (FEN, no moves) of every position of an EPD or FEN file.
+    """
+    with open(path) as file:
+        return [(ChessAnalysis.parseEpd(line)[0], ()) for line in ChessAnalysis.readPositions(file)]
+
+
+def runGame(arguments):
+    return playGame(*arguments)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play a match between two engine configurations.")
+    parser.add_argument("--first", default="", help="settings of the first engine, e.g. \"depth=4\"")
+    parser.add_argument("--second", default="", help="settings of the second engine")
+    parser.add_argument("--games", type=int, default=2 * len(OPENINGS))
+    parser.add_argument("--openings", help="EPD or FEN file of the start positions, built-in openings if not given")
+    parser.add_argument("--pgn", help="file the games are appended to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="games played at once")
+    parser.add_argument("--engine", choices=sorted(ChessBitboard.ENGINES), default="bitboard")
+    args = parser.parse_args(argv)
+    try:
+        configurations = [parseConfiguration(args.first), parseConfiguration(args.second)]
+    except ValueError as error:
+        parser.error(str(error))
+    names = [args.first or "default", args.second or "default"]
+    if names[0] == names[1]:
+        names = [names[0] + " (1)", names[1] + " (2)"]
+    start_fen = ChessEngine.GameState().getFen()
+    if args.openings:
+        openings = readOpenings(args.openings)
+    else:
+        openings = [(start_fen, tuple(line.split())) for line in OPENINGS]
+    tasks = []
+    for number in range(args.games):
+        players = [(names[0], configurations[0]), (names[1], configurations[1])]
+        if number % 2:
+            players.reverse()
+        tasks.append((number + 1, openings[number // 2 % len(openings)], players[0], players[1], args.engine))
+
+    points = {"1-0": (1, 0), "0-1": (0, 1), "1/2-1/2": (0.5, 0.5)}
+    wins = draws = losses = 0
+    nodes = {name: 0 for name in names}
+    seconds = {name: 0.0 for name in names}
+    pgn_file = open(args.pgn, "a") if args.pgn else None
+    start_time = time.perf_counter()
+    try:
+        with multiprocessing.Pool(max(1, min(args.workers, args.games))) as pool:
+            for finished, game in enumerate(pool.imap_unordered(runGame, tasks), 1):
+                first_points = points[game["result"]][0 if game["white"] == names[0] else 1]
+                wins += first_points == 1
+                draws += first_points == 0.5
+                losses += first_points == 0
+                for name in names:
+                    nodes[name] += game["nodes"][name]
+                    seconds[name] += game["seconds"][name]
+                if pgn_file is not None:
+                    writePgn(pgn_file, game, start_fen)
+                print("Game %d/%d (round %d) %s - %s: %s, %s. Score %.1f-%.1f" % (
+                    finished, args.games, game["round"], game["white"], game["black"], game["result"],
+                    game["termination"], wins + draws / 2, losses + draws / 2), flush=True)
+    finally:
+        if pgn_file is not None:
+            pgn_file.close()
+    elo, margin = eloDifference(wins, draws, losses)
+    games = wins + draws + losses
+    print("%s vs %s: +%d =%d -%d, %.1f%%, Elo difference %+.0f +/- %.0f (95%%), %d games in %.1fs" % (
+        names[0], names[1], wins, draws, losses, 100 * (wins + draws / 2) / max(1, games), elo, margin, games,
+        time.perf_counter() - start_time))
+    for name in names:
+        print("%s: %d nodes/s" % (name, nodes[name] / seconds[name] if seconds[name] else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Perft - counting the leaf nodes of the move generation tree to a fixed depth.
+The counts are compared with the well known reference numbers to check the move generator,
+and the nodes per second give its speed.
+
+Run it from this directory, e.g.:
+    python ChessPerft.py --suite --depth 3
+    python ChessPerft.py --position kiwipete --depth 2 --divide
+    python ChessPerft.py --fen "8/8/8/8/8/8/8/K6k w - - 0 1" --depth 4 --engine mailbox --json
+"""
+import argparse
+import json
+import sys
+import time
+
+import ChessBitboard
+
+# name -> (FEN, leaf counts for depth 1, 2, 3, ...)
+REFERENCE_POSITIONS = {
+    "start": ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+              (20, 400, 8902, 197281, 4865609)),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 (48, 2039, 97862, 4085603)),
+    "enpassant": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                  (14, 191, 2812, 43238, 674624)),
+    "promotion": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                  (6, 264, 9467, 422333)),
+    "promotion-mirrored": ("r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+                           (6, 264, 9467, 422333)),
+    "talkchess": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                  (44, 1486, 62379, 2103487)),
+    "middlegame": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                   (46, 2079, 89890, 3894594)),
+}
+
+
+def perft(game_state, depth):
+    """
+    Number of leaf nodes depth plies below the current position.
+    """
+    if depth == 0:
+        return 1  # the position itself is the only leaf
+    moves = game_state.getValidMoves()
+    if depth == 1:
+        return len(moves)  # bulk counting, the last ply doesn't need to be played
+    nodes = 0
+    for move in moves:
+        game_state.makeMove(move)
+        nodes += perft(game_state, depth - 1)
+        game_state.undoMove()
+    return nodes
+
+
+def divide(game_state, depth):
+    """
+    Leaf node count below every root move, useful to find the move a broken generator gets wrong.
+    """
+    counts = {}
+    for move in game_state.getValidMoves():
+        game_state.makeMove(move)
+        counts[moveName(move)] = perft(game_state, depth - 1) if depth > 1 else 1
+        game_state.undoMove()
+    return counts
+
+
+def moveName(move):
+    """
+    Coordinate notation (e.g. e2e4, a7a8n), as used by other engines' divide output.
+    """
+    name = move.getRankFile(move.start_row, move.start_col) + move.getRankFile(move.end_row, move.end_col)
+    if move.is_pawn_promotion:
+        name += move.promotion_piece.lower()
+    return name
+
+
+def newGameState(engine, fen):
+    game_state = ChessBitboard.ENGINES[engine](fen)
+    game_state.underpromotions = True  # the reference numbers count every promotion piece
+    return game_state
+
+
+def runPerft(engine, name, fen, depth, expected=None, divide_moves=False):
+    """
+    Run one perft and return its result record.
+    """
+    game_state = newGameState(engine, fen)
+    start_time = time.perf_counter()
+    if divide_moves:
+        counts = divide(game_state, depth)
+        nodes = sum(counts.values())
+    else:
+        counts = None
+        nodes = perft(game_state, depth)
+    seconds = time.perf_counter() - start_time
+    result = {"position": name, "fen": fen, "engine": engine, "depth": depth, "nodes": nodes,
+              "seconds": round(seconds, 4), "nps": round(nodes / seconds) if seconds > 0 else 0,
+              "expected": expected, "ok": expected is None or nodes == expected}
+    if counts is not None:
+        result["divide"] = counts
+    return result
+
+
+def printResult(result):
+    status = "" if result["expected"] is None else ("  OK" if result["ok"] else "  FAIL (expected %d)" %
+                                                                               result["expected"])
+    print("%-18s depth %d  nodes %10d  time %8.3fs  %9d nodes/s%s" % (
+        result["position"], result["depth"], result["nodes"], result["seconds"], result["nps"], status))
+    for move, nodes in sorted(result.get("divide", {}).items()):
+        print("    %-6s %d" % (move, nodes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count move generation tree leaf nodes and measure their speed.")
+    parser.add_argument("--depth", type=int, default=3, help="search depth, the maximum depth with --suite")
+    parser.add_argument("--fen", help="position to count from")
+    parser.add_argument("--position", choices=sorted(REFERENCE_POSITIONS), default="start",
+                        help="reference position to count from when no FEN is given")
+    parser.add_argument("--suite", action="store_true", help="check every reference position up to --depth")
+    parser.add_argument("--divide", action="store_true", help="print the leaf count below every root move")
+    parser.add_argument("--engine", choices=sorted(ChessBitboard.ENGINES), default="bitboard")
+    parser.add_argument("--json", action="store_true", help="print a machine-readable report instead of text")
+    args = parser.parse_args(argv)
+    if args.depth < 0:
+        parser.error("--depth must not be negative")
+    if args.divide and args.depth == 0:
+        parser.error("--divide needs a depth of at least 1")
+
+    results = []
+    if args.suite:
+        for name, (fen, counts) in REFERENCE_POSITIONS.items():
+            for depth in range(1, min(args.depth, len(counts)) + 1):
+                results.append(runPerft(args.engine, name, fen, depth, counts[depth - 1]))
+                if not args.json:
+                    printResult(results[-1])
+    else:
+        if args.fen is not None:
+            name, fen, expected = "fen", args.fen, None
+        else:
+            name = args.position
+            fen, counts = REFERENCE_POSITIONS[name]
+            expected = counts[args.depth - 1] if 1 <= args.depth <= len(counts) else None
+        results.append(runPerft(args.engine, name, fen, args.depth, expected, args.divide))
+        if not args.json:
+            printResult(results[-1])
+
+    total_nodes = sum(result["nodes"] for result in results)
+    total_seconds = sum(result["seconds"] for result in results)
+    passed = all(result["ok"] for result in results)
+    if args.json:
+        print(json.dumps({"engine": args.engine, "python": sys.version.split()[0], "results": results,
+                          "total_nodes": total_nodes, "total_seconds": round(total_seconds, 4),
+                          "nps": round(total_nodes / total_seconds) if total_seconds > 0 else 0,
+                          "ok": passed}, indent=2))
+    else:
+        print("total: %d nodes in %.3fs, %d nodes/s, %s" % (
+            total_nodes, total_seconds, total_nodes / total_seconds if total_seconds > 0 else 0,
+            "all counts match" if passed else "MISMATCHES FOUND"))
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+UCI (Universal Chess Interface) front-end - the engine without pygame, for chess GUIs, test harnesses and
+tournament managers, e.g. cutechess-cli, Arena or a headless server.
+
+Commands are read from standard input on the main thread while the search runs in a thread of its own,
+so stop, isready and quit are answered at once during a search. Supported commands:
+    uci, isready, ucinewgame, setoption name Threads value N, setoption name ProfileFile value PATH,
+    setoption name SearchTiming value [true | false],
+    position [startpos | fen FEN] [moves ...],
+    go [depth D] [movetime T] [wtime T] [btime T] [winc T] [binc T] [movestogo N] [nodes N] [infinite],
+    stop, debug [on | off], quit
+Every completed depth is reported with an info line (depth, score, nodes, nps, time, pv). With debug on, the
+statistics of the search follow the bestmove as info string lines. With SearchTiming on, they include the time spent
+in every phase of the search, at a cost in speed. ProfileFile writes a cProfile of the next search to PATH.
+
+Run it from this directory, e.g.:
+    python ChessUCI.py
+    python ChessUCI.py --engine mailbox
+"""
+import argparse
+import math
+import multiprocessing
+import sys
+import threading
+import time
+
+import ChessAI
+import ChessBitboard
+import ChessWorker
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+MOVES_TO_GO = 30  # moves the remaining time is shared between when the GUI doesn't say
+MOVE_OVERHEAD = 50  # milliseconds kept back for the GUI to receive the move
+MAX_THREADS = 64
+
+
+def uciMove(move):
+    """
+    The move in UCI long algebraic notation, e.g. e2e4, e1g1 (castling), e7e8q.
+    """
+    notation = move.getRankFile(move.start_row, move.start_col) + move.getRankFile(move.end_row, move.end_col)
+    return notation + move.promotion_piece.lower() if move.is_pawn_promotion else notation
+
+
+def searchTime(own_time, increment, moves_to_go):
+    """
+    Milliseconds to spend on the move with own_time left on the clock.
+    """
+    budget = own_time / (moves_to_go or MOVES_TO_GO) + increment * 3 / 4
+    return max(1, min(budget, own_time / 2) - MOVE_OVERHEAD)
+
+
+class UciEngine:
+    """
+    The position set by the GUI and the search running on it. The search thread owns game_state until it ends,
+    every command that changes the position stops it first.
+    """
+
+    def __init__(self, engine="bitboard", output=sys.stdout):
+        self.new_game_state = ChessBitboard.ENGINES[engine]
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.game_state = self.newGameState(START_FEN)
+        self.threads = 1
+        self.debug = False
+        self.search_thread = None
+        self.stop_event = None
+        self.search_start = None
+
+    def newGameState(self, fen):
+        game_state = self.new_game_state(fen)
+        game_state.underpromotions = True  # a GUI may play them
+        return game_state
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def handle(self, line):
+        """
+        Carry out one command line, returns False on quit.
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name Python Chess Engine")
+            self.send("id author Python Chess Engine contributors")
+            self.send("option name Threads type spin default 1 min 1 max %d" % MAX_THREADS)
+            self.send("option name ProfileFile type string default <empty>")
+            self.send("option name SearchTiming type check default false")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stop()
+            ChessAI.newGame()
+        elif command == "debug":
+            self.debug = arguments[:1] == ["on"]
+        elif command == "setoption":
+            self.setOption(arguments)
+        elif command == "position":
+            self.stop()
+            self.setPosition(arguments)
+        elif command == "go":
+            self.stop()
+            self.go(arguments)
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            return False
+        else:
+            print("Unknown command: %s" % line.strip(), file=sys.stderr)
+        return True
+
+    def setOption(self, arguments):
+        line = " ".join(arguments)
+        name, _, value = line.partition(" value ")
+        name, value = name.replace("name", "", 1).strip().lower(), value.strip()
+        if name == "threads" and value.isdigit():
+            self.threads = max(1, min(int(value), MAX_THREADS))
+        elif name == "searchtiming" and value in ("true", "false"):
+            ChessAI.SEARCH_TIMING = value == "true"
+        elif name == "profilefile":
+            ChessAI.profileNextSearch(value if value and value != "<empty>" else None)
+
+    def setPosition(self, arguments):
+        moves = []
+        if "moves" in arguments:
+            moves = arguments[arguments.index("moves") + 1:]
+            arguments = arguments[:arguments.index("moves")]
+        if arguments and arguments[0] == "fen":
+            fen = " ".join(arguments[1:])
+        else:
+            fen = START_FEN
+        try:
+            game_state = self.newGameState(fen)
+        except ValueError as error:
+            print("Invalid FEN (%s), keeping the previous position." % error, file=sys.stderr)
+            return
+        self.game_state = game_state
+        for notation in moves:
+            move = next((move for move in self.game_state.getValidMoves() if uciMove(move) == notation), None)
+            if move is None:
+                print("Illegal move %s, ignoring the rest of the moves." % notation, file=sys.stderr)
+                break
+            self.game_state.makeMove(move)
+
+    def go(self, arguments):
+        limits = {}
+        for index, token in enumerate(arguments[:-1]):
+            if token in ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo", "nodes") and \
+                    arguments[index + 1].lstrip("-").isdigit():
+                limits[token] = int(arguments[index + 1])
+        search_options = {"max_depth": limits.get("depth", ChessAI.MAX_PLY), "max_nodes": limits.get("nodes")}
+        if "movetime" in limits:
+            search_options["movetime"] = limits["movetime"]
+        else:
+            own_time = limits.get("wtime" if self.game_state.white_to_move else "btime")
+            if own_time is not None:
+                increment = limits.get("winc" if self.game_state.white_to_move else "binc", 0)
+                search_options["movetime"] = searchTime(own_time, increment, limits.get("movestogo"))
+        if "infinite" not in arguments and "depth" not in limits and "nodes" not in limits and \
+                "movetime" not in search_options:
+            search_options["max_depth"] = ChessAI.DEPTH  # a bare go
+        if self.threads > 1:
+            search_options["workers"] = self.threads
+        # a multiprocessing event, so that the findBestMoveParallel workers see it too
+        self.stop_event = multiprocessing.Event()
+        self.search_thread = threading.Thread(target=self.search, daemon=True,
+                                              args=(self.stop_event, search_options, "infinite" in arguments))
+        self.search_thread.start()
+
+    def search(self, stop_event, search_options, infinite):
+        self.search_start = time.perf_counter()
+        ChessAI.depth_listener = self.sendInfo
+        try:
+            if self.game_state.getValidMoves():
+                best_move, ponder_move = ChessWorker.search(self.game_state, stop_event, search_options)
+            else:
+                best_move = ponder_move = None  # checkmate or stalemate
+        finally:
+            ChessAI.depth_listener = None
+        if infinite:
+            stop_event.wait()  # the GUI expects the move only after its stop
+        if best_move is None:
+            self.send("bestmove 0000")
+        elif ponder_move is not None:
+            self.send("bestmove %s ponder %s" % (uciMove(best_move), uciMove(ponder_move)))
+        else:
+            self.send("bestmove %s" % uciMove(best_move))
+        if self.debug:
+            for line in ChessAI.search_stats.summary().splitlines():
+                self.send("info string " + line)
+
+    def sendInfo(self, stats):
+        milliseconds = max(1, round((time.perf_counter() - self.search_start) * 1000))
+        nodes = stats.nodes + stats.quiescence_nodes
+        if abs(stats.score) >= ChessAI.CHECKMATE:
+            # mate scores don't hold the distance, it is at most the depth searched
+            score = "mate %d" % (math.copysign(math.ceil(stats.depth / 2), stats.score))
+        else:
+            score = "cp %d" % round(stats.score * 100)
+        # called between two depths, when the search isn't using game_state
+        variation = ChessAI.extendPrincipalVariation(self.game_state, stats.principal_variation, stats.depth)
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s" % (
+            stats.depth, score, nodes, nodes * 1000 // milliseconds, milliseconds,
+            " ".join(uciMove(move) for move in variation)))
+
+    def stop(self):
+        """
+        Stop the running search, if any, and wait for its bestmove.
+        """
+        if self.search_thread is not None:
+            self.stop_event.set()
+            self.search_thread.join()
+            self.search_thread = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the engine as a UCI engine on standard input and output.")
+    parser.add_argument("--engine", choices=sorted(ChessBitboard.ENGINES), default="bitboard")
+    args = parser.parse_args(argv)
+    engine = UciEngine(args.engine)
+    # Not sys.stdin itself: a findBestMoveParallel worker closes its copy of sys.stdin when it starts, which would
+    # wait forever on the lock held by the read in progress here when the worker was forked.
+    commands = open(sys.stdin.fileno(), closefd=False)
+    for line in commands:
+        if not engine.handle(line):
+            break
+    else:
+        engine.stop()  # end of input
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""
+Long-lived engine process for the GUI.
+Instead of pickling the whole GameState into a new process for every AI move, the engine keeps its own copy of
+the game, updated with the moveID of every move played, and its search tables stay warm from move to move.
+A search with several workers uses a ChessAI.SearchPool started by the first such search and kept for the rest of
+the session, so the tables of its worker processes stay warm too. They are cleared only on newgame.
+"""
+import atexit
+import math
+import multiprocessing
+import queue
+import sys
+import time
+
+import ChessAI
+import ChessBitboard
+
+
+class EngineWorker:
+    """
+    Handle of the engine process. Commands go through a queue and are handled in order:
+    newgame, move, undo, go, ponder and quit. A running search is stopped cooperatively through a shared value,
+    because the engine doesn't read the queue while it searches. For the same reason a ponder hit only sets
+    the deadline of the ponder search in another shared value.
+    """
+
+    def __init__(self, use_bitboards=True):
+        self.commands = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.stopped_search = multiprocessing.Value("i", 0)  # the id of the last search asked to stop
+        self.ponder_deadline = multiprocessing.Value("d", math.inf)  # time.perf_counter() value, set on a hit
+        self.search_id = 0
+        self.thinking = False
+        self.pondering = False
+        self.ponder_start = None
+        self.best_move = None
+        self.ponder_move = None  # the reply expected to best_move
+        # not a daemon, so that it can start a ChessAI.SearchPool - quit() ends it instead
+        self.process = multiprocessing.Process(target=runEngine, args=(self.commands, self.results,
+                                                                       self.stopped_search, self.ponder_deadline,
+                                                                       use_bitboards))
+        self.process.start()
+        atexit.register(self.quit)
+
+    def newGame(self):
+        self.stop()
+        self.commands.put(("newgame",))
+
+    def makeMove(self, move):
+        self.commands.put(("move", move.moveID))
+
+    def undoMove(self):
+        self.stop()
+        self.commands.put(("undo",))
+
+    def go(self, zobrist_key, **search_options):
+        """
+        Start searching the current position, search_options are passed on to ChessAI.findBestMove.
+        zobrist_key is the GUI's key of the position, to check that both sides agree on it.
+        """
+        self.search_id += 1
+        self.thinking = True
+        self.best_move = None
+        self.ponder_move = None
+        self.commands.put(("go", self.search_id, zobrist_key, search_options))
+
+    def ponder(self, zobrist_key, ponder_move, **search_options):
+        """
+        Start searching the position after ponder_move, the opponent's expected reply, without a time limit.
+        The engine takes the move back when the search ends, so makeMove has to be sent for the move actually
+        played either way. If it is ponder_move, call ponderHit and the search goes on as the real one,
+        otherwise stop it and start a new one with go.
+        """
+        self.search_id += 1
+        self.thinking = True
+        self.pondering = True
+        self.best_move = None
+        self.ponder_move = ponder_move  # until the search is over
+        self.ponder_start = time.perf_counter()
+        self.ponder_deadline.value = math.inf
+        self.commands.put(("ponder", self.search_id, zobrist_key, search_options, ponder_move.moveID))
+
+    def ponderHit(self, movetime):
+        """
+        The opponent played the expected move, the ponder search goes on until movetime milliseconds after it
+        started. The time already spent pondering counts, so after a long think the move comes at once.
+        """
+        if self.pondering:
+            self.ponder_deadline.value = self.ponder_start + movetime / 1000
+            self.pondering = False
+
+    def stop(self):
+        """
+        Ask the current search to stop, its move will be ignored.
+        """
+        if self.thinking:
+            self.stopped_search.value = self.search_id
+            self.thinking = False
+            self.pondering = False
+
+    def poll(self):
+        """
+        True once the search started by the last go (or ponder, after ponderHit) has finished, the move it found
+        is then in best_move and the expected reply in ponder_move.
+        """
+        while self.thinking and not self.pondering:
+            try:
+                search_id, move, ponder_move = self.results.get_nowait()
+            except queue.Empty:
+                return False
+            if search_id == self.search_id:
+                self.thinking = False
+                self.best_move = move
+                self.ponder_move = ponder_move
+                return True
+        return False
+
+    def quit(self):
+        if self.process.is_alive():
+            self.stop()
+            self.commands.put(("quit",))
+            self.process.join(1)
+
+
+class StopFlag:
+    """
+    stop_event for ChessAI: set once the search with search_id (or a later one) was asked to stop,
+    or for a ponder search once the deadline given by a ponder hit has passed.
+    """
+
+    def __init__(self, stopped_search, search_id, ponder_deadline=None):
+        self.stopped_search = stopped_search
+        self.search_id = search_id
+        self.ponder_deadline = ponder_deadline
+
+    def is_set(self):
+        if self.stopped_search.value >= self.search_id:
+            return True
+        return self.ponder_deadline is not None and time.perf_counter() >= self.ponder_deadline.value
+
+
+def newGameState(use_bitboards):
+    return ChessBitboard.ENGINES["bitboard" if use_bitboards else "mailbox"]()
+
+
+def search(game_state, stop_event, search_options, search_pool=None):
+    """
+    Search the position and return (best move, expected reply or None).
+    With a workers search option above 1 the search is split across search_pool, or a pool of its own if None.
+    """
+    ChessAI.stop_event = stop_event
+    workers = search_options.pop("workers", 1)
+    if workers > 1:
+        best_move, stats = ChessAI.findBestMoveParallel(game_state, game_state.getValidMoves(), None,
+                                                        workers=workers, search_pool=search_pool, **search_options)
+    else:
+        best_move, stats = ChessAI.findBestMove(game_state, game_state.getValidMoves(), None, **search_options)
+    if best_move is None:
+        return None, None
+    principal_variation = stats.principal_variation if stats.principal_variation[:1] == [best_move] else [best_move]
+    variation = ChessAI.extendPrincipalVariation(game_state, principal_variation, 2)
+    return best_move, variation[1] if len(variation) > 1 else None
+
+
+def runEngine(commands, results, stopped_search, ponder_deadline, use_bitboards):
+    """
+    Main loop of the engine process.
+    """
+    game_state = newGameState(use_bitboards)
+    search_pool = None
+    while True:
+        command = commands.get()
+        if command[0] == "move":
+            move_id = command[1]
+            for move in game_state.getValidMoves():
+                if move.moveID == move_id:
+                    game_state.makeMove(move)
+                    break
+        elif command[0] == "undo":
+            game_state.undoMove()
+        elif command[0] in ("go", "ponder"):
+            search_id, zobrist_key, search_options = command[1:4]
+            best_move = ponder_move = None
+            workers = search_options.get("workers", 1)
+            if workers > 1 and (search_pool is None or search_pool.workers != workers):
+                if search_pool is not None:
+                    search_pool.close()
+                search_pool = ChessAI.SearchPool(game_state, workers)
+            if zobrist_key != game_state.zobrist_key:
+                print("The engine's position is out of sync with the GUI, not searching.", file=sys.stderr)
+            elif command[0] == "go" and stopped_search.value < search_id:
+                best_move, ponder_move = search(game_state, StopFlag(stopped_search, search_id), search_options,
+                                                search_pool)
+            elif command[0] == "ponder" and stopped_search.value < search_id:
+                # search the position after the expected reply, the move is taken back afterwards either way
+                for move in game_state.getValidMoves():
+                    if move.moveID == command[4]:
+                        game_state.makeMove(move)
+                        best_move, ponder_move = search(game_state,
+                                                        StopFlag(stopped_search, search_id, ponder_deadline),
+                                                        search_options, search_pool)
+                        game_state.undoMove()
+                        break
+            results.put((search_id, best_move, ponder_move))
+        elif command[0] == "newgame":
+            game_state = newGameState(use_bitboards)
+            ChessAI.newGame()
+            if search_pool is not None:
+                search_pool.newGame(game_state)
+        elif command[0] == "quit":
+            break
+    if search_pool is not None:
+        search_pool.close()